@@ -1,6 +1,7 @@
 import os
 import bpy
 import sys
+import json
 import typing
 import inspect
 import pkgutil
@@ -20,8 +21,13 @@ def init():
     global modules
     global ordered_classes
 
-    modules = get_all_submodules(Path(__file__).parent)
-    ordered_classes = get_ordered_classes_to_register(modules)
+    directory = Path(__file__).parent
+    modules = get_all_submodules(directory)
+    signature = get_source_signature(directory)
+    ordered_classes = load_cached_order(signature)
+    if ordered_classes is None:
+        ordered_classes = get_ordered_classes_to_register(modules)
+        save_cached_order(signature, ordered_classes)
 
 def register():
     for cls in ordered_classes:
@@ -64,6 +70,51 @@ def iter_submodule_names(path, root=""):
             yield root + module_name
 
 
+# Cache the registration order
+#################################################
+
+def get_order_cache_path():
+    from .utils.paths import get_cache_dir
+    return os.path.join(get_cache_dir(), "register_order_%s.json" % __package__)
+
+def get_source_signature(directory):
+    # Any edited, added or removed source file invalidates the cached order
+    files = []
+    for path in sorted(directory.rglob("*.py")):
+        stat = path.stat()
+        files.append([str(path.relative_to(directory)), stat.st_mtime_ns, stat.st_size])
+    return {"directory": str(directory), "blender": list(bpy.app.version), "files": files}
+
+def load_cached_order(signature):
+    try:
+        with open(get_order_cache_path()) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("signature") != signature:
+        return None
+    classes = []
+    for module_name, qualname in data["classes"]:
+        value = sys.modules.get(module_name)
+        for name in qualname.split("."):
+            value = getattr(value, name, None)
+        if not inspect.isclass(value):
+            return None
+        classes.append(value)
+    return classes
+
+def save_cached_order(signature, classes):
+    data = {
+        "signature": signature,
+        "classes": [[cls.__module__, cls.__qualname__] for cls in classes],
+    }
+    try:
+        with open(get_order_cache_path(), "w") as f:
+            json.dump(data, f)
+    except OSError:
+        pass
+
+
 # Find classes to register
 #################################################
 
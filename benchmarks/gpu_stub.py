@@ -0,0 +1,97 @@
+"""Stand-ins for gpu, gpu_extras, bgl and blf when Blender runs without a GPU context.
+
+They keep the CPU side of the draw code (building vertex lists, walking the
+cards) while dropping every GPU call, so draw preparation can be timed under
+blender --background.
+"""
+import sys
+import types
+from contextlib import contextmanager
+
+
+class StubShader:
+    def __init__(self, *args):
+        pass
+
+    def bind(self):
+        pass
+
+    def uniform_int(self, name, value):
+        pass
+
+    def uniform_float(self, name, value):
+        pass
+
+
+class StubBatch:
+    def __init__(self, shader, kind, content, indices=None):
+        # The real batch copies every attribute into a vertex buffer
+        self.content = {name: list(data) for name, data in content.items()}
+        self.indices = list(indices) if indices is not None else None
+
+    def draw(self, shader=None):
+        pass
+
+
+def batch_for_shader(shader, kind, content, indices=None):
+    return StubBatch(shader, kind, content, indices)
+
+
+def make_gpu():
+    gpu = types.ModuleType('gpu')
+    gpu.shader = types.SimpleNamespace(from_builtin=StubShader)
+    gpu.types = types.SimpleNamespace(GPUShader=StubShader, GPUOffScreen=None)
+
+    @contextmanager
+    def push_pop():
+        yield
+
+    gpu.matrix = types.SimpleNamespace(
+        push_pop=push_pop,
+        translate=lambda offset: None,
+        scale=lambda scale: None,
+        load_matrix=lambda matrix: None,
+        load_projection_matrix=lambda matrix: None,
+    )
+    return gpu
+
+
+def make_bgl():
+    bgl = types.ModuleType('bgl')
+    bgl.GL_TEXTURE0 = 0
+    bgl.GL_TEXTURE_2D = 0
+    bgl.GL_BLEND = 0
+    for name in ('glLineWidth', 'glActiveTexture', 'glBindTexture', 'glEnable', 'glDisable'):
+        setattr(bgl, name, lambda *args: None)
+    return bgl
+
+
+def make_blf():
+    blf = types.ModuleType('blf')
+    state = {'size': 12}
+
+    def size(fontid, size, dpi=72):
+        state['size'] = size
+
+    def dimensions(fontid, text):
+        return len(text) * state['size'] * 0.6, state['size']
+
+    blf.size = size
+    blf.dimensions = dimensions
+    for name in ('position', 'color', 'draw', 'enable', 'disable'):
+        setattr(blf, name, lambda *args: None)
+    return blf
+
+
+def install():
+    gpu_extras = types.ModuleType('gpu_extras')
+    batch = types.ModuleType('gpu_extras.batch')
+    batch.batch_for_shader = batch_for_shader
+    gpu_extras.batch = batch
+    sys.modules.update({
+        'gpu': make_gpu(),
+        'gpu_extras': gpu_extras,
+        'gpu_extras.batch': batch,
+        'bgl': make_bgl(),
+        'blf': make_blf(),
+    })
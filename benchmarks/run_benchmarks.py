@@ -0,0 +1,281 @@
+"""Headless benchmarks of importing, laying out and preparing to draw boards.
+
+Run from a shell, Blender never opens a window:
+
+    blender --background --factory-startup --python benchmarks/run_benchmarks.py -- \
+        --cards 100 1000 10000 --output benchmark.json
+
+Synthetic PNGs are written to a temporary directory (or --images) and
+reused by every board size. Without a GPU context gpu, bgl and blf are
+replaced by the stand-ins of gpu_stub.py, which keeps the CPU side of the
+draw code (culling, vertex lists, header truncation) and drops the GPU calls.
+Node dimensions are only computed by the node editor, so headless cards have
+a zero size and culling is timed on their locations.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import bpy
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCHMARK_DIR)
+
+REGION_SIZE = (1920, 1080)
+LAYOUT_MODES = ('SHELF', 'JUSTIFIED', 'SKYLINE')
+# Skyline packing is quadratic, past this many cards it only slows the run down
+SKYLINE_LIMIT = 2000
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(prog='run_benchmarks.py')
+    parser.add_argument('--cards', type=int, nargs='+', default=[100, 1000, 10000], help='Board sizes to run')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file the results are written to')
+    parser.add_argument('--images', default=None, help='Directory for the synthetic images, kept between runs')
+    parser.add_argument('--max-side', type=int, default=256, help='Longest side of the synthetic images')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions of the draw preparation timings')
+    return parser.parse_args(argv)
+
+
+def has_gpu():
+    if bpy.app.background:
+        return False
+    try:
+        import gpu
+        gpu.shader.from_builtin('2D_SMOOTH_COLOR')
+    except Exception:
+        return False
+    return True
+
+
+def import_addon():
+    if not has_gpu():
+        sys.path.insert(0, BENCHMARK_DIR)
+        import gpu_stub
+        gpu_stub.install()
+    sys.path.insert(0, os.path.dirname(ADDON_DIR))
+    addon = importlib.import_module(os.path.basename(ADDON_DIR))
+    addon.register()
+    return addon
+
+
+class Timer:
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self.start
+
+
+def best_of(repeat, function):
+    times = []
+    for _ in range(repeat):
+        with Timer() as timer:
+            function()
+        times.append(timer.seconds)
+    return min(times)
+
+
+def generate_images(directory, count, max_side):
+    """Unique PNGs of assorted sizes and aspect ratios, existing files are reused"""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, 'card_%05d.png' % i)
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        width, height = (int(side) for side in rng.integers(max_side // 4, max_side + 1, 2))
+        # A gradient tinted per image keeps every file distinct for the content hash
+        u = np.linspace(0, 1, width, dtype=np.float32)
+        v = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+        pixels = np.empty((height, width, 4), dtype=np.float32)
+        pixels[..., 0] = u
+        pixels[..., 1] = v
+        pixels[..., 2] = (i % 997) / 997
+        pixels[..., 3] = 1
+        image = bpy.data.images.new('benchmark', width, height, alpha=True)
+        image.pixels.foreach_set(pixels.ravel())
+        image.filepath_raw = path
+        image.file_format = 'PNG'
+        image.save()
+        bpy.data.images.remove(image)
+    return paths
+
+
+def clear_board(node_tree, ntree):
+    ntree.nodes.clear()
+    for image in list(bpy.data.images):
+        bpy.data.images.remove(image)
+    # Same as after an undo, nothing may keep pointers to the removed data
+    node_tree.free_board_caches(None)
+
+
+class View2D:
+    """Affine view2d of a region looking at a rectangle of the board"""
+
+    def __init__(self, xmin, ymin, xmax, ymax, width, height):
+        self.xmin = xmin
+        self.ymin = ymin
+        self.scale_x = width / max(xmax - xmin, 1e-6)
+        self.scale_y = height / max(ymax - ymin, 1e-6)
+
+    def view_to_region(self, x, y, clip=True):
+        return (x - self.xmin) * self.scale_x, (y - self.ymin) * self.scale_y
+
+    def region_to_view(self, x, y):
+        return x / self.scale_x + self.xmin, y / self.scale_y + self.ymin
+
+
+def make_region(xmin, ymin, xmax, ymax):
+    width, height = REGION_SIZE
+    return SimpleNamespace(width=width, height=height, view2d=View2D(xmin, ymin, xmax, ymax, width, height))
+
+
+def get_views(nodes, dpiFactor):
+    """A region showing the whole board and one zoomed in on its middle"""
+    xs = np.array([node.location.x for node in nodes]) * dpiFactor
+    ys = np.array([node.location.y for node in nodes]) * dpiFactor
+    xmin, xmax, ymin, ymax = xs.min(), xs.max() + 1, ys.min() - 1, ys.max()
+    center_x, center_y = (xmin + xmax) / 2, (ymin + ymax) / 2
+    width, height = REGION_SIZE
+    return {
+        'board': make_region(xmin, ymin, xmax, ymax),
+        'zoomed': make_region(center_x - width / 2, center_y - height / 2, center_x + width / 2, center_y + height / 2),
+    }
+
+
+def bench_draw_prep(ntree, repeat):
+    draw_utils = importlib.import_module(os.path.basename(ADDON_DIR) + '.utils.draw_utils')
+
+    dpiFactor = draw_utils.get_dpi_factor()
+    results = {}
+    for name, region in get_views(ntree.nodes, dpiFactor).items():
+        context = SimpleNamespace(region=region, selected_nodes=[])
+        frame = draw_utils.DrawContext(region)
+        draw_utils.free_board_indices()
+        with Timer() as index_timer:
+            nodes = draw_utils.get_visible_cards(ntree, context, frame)
+        cull = best_of(repeat, lambda: draw_utils.get_visible_cards(ntree, context, frame))
+
+        colors = [draw_utils.get_card_colors(node, ntree) for node in nodes]
+
+        draw_utils.free_card_batches()
+        renderer = draw_utils.BoardRenderer()
+        with Timer() as cold_timer:
+            cards = [draw_utils.get_card_batches(node, dpiFactor) for node in nodes]
+            renderer.build_backgrounds(cards, colors)
+            renderer.build_borders(cards, colors)
+
+        def warm():
+            cards = [draw_utils.get_card_batches(node, dpiFactor) for node in nodes]
+            renderer.build_backgrounds(cards, colors)
+            renderer.build_borders(cards, colors)
+        batch = best_of(repeat, warm)
+        rects = draw_utils.get_card_rects(cards)
+        transform = best_of(repeat, lambda: draw_utils.get_header_positions(rects, frame))
+        text = best_of(repeat, lambda: draw_utils.draw_headers(nodes, rects, frame))
+
+        results[name] = {
+            'visible_cards': len(nodes),
+            'index_build_s': index_timer.seconds,
+            'cull_s': cull,
+            'batch_cold_s': cold_timer.seconds,
+            'batch_warm_s': batch,
+            'header_transform_s': transform,
+            'text_s': text,
+        }
+    return results
+
+
+def bench_board(addon, ntree, paths, repeat):
+    ops = importlib.import_module(addon.__name__ + '.operators.ops')
+    node_tree = importlib.import_module(addon.__name__ + '.node_tree')
+    result = {'cards': len(paths)}
+
+    # Cold: empty hash index and proxy cache. Warm: both filled by the cold run
+    for run in ('cold', 'warm'):
+        clear_board(node_tree, ntree)
+        with Timer() as timer:
+            ops.load_images(ntree, paths)
+        result['load_images_%s_s' % run] = timer.seconds
+    result['nodes'] = len(ntree.nodes)
+
+    nodes = [node for node in ntree.nodes if node.bl_idname == 'CardNode']
+    widths = [node.width for node in nodes]
+    for mode in LAYOUT_MODES:
+        if mode == 'SKYLINE' and len(nodes) > SKYLINE_LIMIT:
+            result['layout_%s_s' % mode.lower()] = None
+            continue
+        with Timer() as timer:
+            ops.layout_cards(nodes, mode)
+        result['layout_%s_s' % mode.lower()] = timer.seconds
+        # Justified rows resize the cards, start every mode from the same widths
+        for node, width in zip(nodes, widths):
+            node.width = width
+    ops.layout_cards(nodes, 'SHELF')
+
+    result['draw_prep'] = bench_draw_prep(ntree, repeat)
+    return result
+
+
+def main():
+    args = parse_args()
+    temp = tempfile.mkdtemp(prefix='blendref_benchmark_')
+    # Keep the hash index and proxy cache of the user out of the measurements
+    os.environ['XDG_CACHE_HOME'] = os.environ['LOCALAPPDATA'] = os.path.join(temp, 'cache')
+    image_dir = args.images or os.path.join(temp, 'images')
+
+    try:
+        addon = import_addon()
+        decode = importlib.import_module(addon.__name__ + '.utils.decode')
+
+        with Timer() as timer:
+            paths = generate_images(image_dir, max(args.cards), args.max_side)
+        print("Synthetic images ready in %.1f s" % timer.seconds)
+
+        ntree = bpy.data.node_groups.new('BlendRef Benchmark', 'BlendRefTreeType')
+        boards = []
+        for count in sorted(args.cards):
+            print("Benchmarking %d cards" % count)
+            boards.append(bench_board(addon, ntree, paths[:count], args.repeat))
+            print(json.dumps(boards[-1], indent=1))
+
+        report = {
+            'time': time.time(),
+            'blender': bpy.app.version_string,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'addon_version': list(addon.bl_info['version']),
+            'gpu': has_gpu(),
+            'pillow': decode.get_pillow() is not None,
+            'max_side': args.max_side,
+            'boards': boards,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+        print("Results written to " + os.path.abspath(args.output))
+
+        decode.shutdown_executor()
+        addon.unregister()
+    finally:
+        shutil.rmtree(temp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Time enabling the add-on, one measurement per Blender process.
+
+    blender --background --factory-startup --python benchmarks/startup.py -- --cold
+    blender --background --factory-startup --python benchmarks/startup.py
+
+--cold deletes the cached registration order first, the second run then
+shows the warm start. Results are appended to --output as JSON lines.
+"""
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import time
+
+import bpy
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(prog='startup.py')
+    parser.add_argument('--cold', action='store_true', help='Delete the cached registration order first')
+    parser.add_argument('--output', default='startup.jsonl', help='File the result is appended to')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    package = os.path.basename(ADDON_DIR)
+    sys.path.insert(0, os.path.dirname(ADDON_DIR))
+    # Importing it as part of the package would already run auto_load
+    spec = importlib.util.spec_from_file_location('blendref_paths', os.path.join(ADDON_DIR, 'utils', 'paths.py'))
+    paths = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(paths)
+    cache = os.path.join(paths.get_cache_dir(), 'register_order_%s.json' % package)
+    if args.cold and os.path.exists(cache):
+        os.remove(cache)
+    cached_mtime = os.stat(cache).st_mtime_ns if os.path.exists(cache) else None
+
+    preloaded = {name: name in sys.modules for name in ('numpy', 'PIL')}
+    start = time.perf_counter()
+    addon = importlib.import_module(package)
+    imported = time.perf_counter()
+    addon.register()
+    registered = time.perf_counter()
+
+    result = {
+        'time': time.time(),
+        'blender': bpy.app.version_string,
+        'import_s': imported - start,
+        'register_s': registered - imported,
+        'total_s': registered - start,
+        # The cache file is only rewritten when the cached order was stale
+        'order_cached': cached_mtime is not None and os.stat(cache).st_mtime_ns == cached_mtime,
+        'numpy_imported': not preloaded['numpy'] and 'numpy' in sys.modules,
+        'pillow_imported': not preloaded['PIL'] and 'PIL' in sys.modules,
+    }
+    addon.unregister()
+    print(json.dumps(result, indent=1))
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,18 @@ import nodeitems_utils
 from nodeitems_utils import NodeCategory, NodeItem
 import bgl 
 import time 
+from bpy.app.handlers import persistent
+from .utils.draw_utils import DrawContext, free_card_batches, free_board_indices, free_board_renderers, get_visible_cards, draw_board, draw_profiler_overlay
+from .utils import profiler
+from .utils.lod import free_image_lods
+from .utils.atlas import free_atlas
+from .utils.texture_budget import free_texture_budget
+from .utils.loader import free_loader
+from .utils.text_metrics import free_text_metrics
+from .utils.tiles import free_tiles
+from .utils.features import free_feature_indexes
+from .utils.composite import draw_composite, free_composites
+from .preferences import get_preferences
 
 
 class BlendRefNodes(NodeTree):
@@ -12,6 +24,17 @@ class BlendRefNodes(NodeTree):
     bl_label = "BlendRef"
     bl_icon = 'NODETREE'
 
+    watch_folder: bpy.props.StringProperty(
+        name='Watch Folder',
+        description='Folder whose images are kept in sync with the cards of this board',
+        subtype='DIR_PATH',
+    )
+    watch_enabled: bpy.props.BoolProperty(
+        name='Watch',
+        description='Add, reload and flag cards as images are added to, changed in or deleted from the watch folder',
+        default=False,
+    )
+
 class BlendRefCategory(NodeCategory):
     @classmethod
     def poll(cls, context):
@@ -21,14 +44,40 @@ class BlendRefCategory(NodeCategory):
 def draw_handler():
     context = bpy.context
     if context.space_data.tree_type == 'BlendRefTreeType': 
-        then = time.time()
         ntree = context.space_data.edit_tree
         if ntree is None:
             return
-        for node in ntree.nodes:
-            if node.type != 'FRAME':
-                node.draw(ntree)
-        # print(1/(time.time() - then))
+        profiler.begin_frame()
+        # Region transform and DPI are read once and shared by the whole frame
+        frame = DrawContext(context.region)
+        if not (get_preferences().use_board_composite and draw_composite(ntree, context, frame)):
+            with profiler.Stage('nodes'):
+                cards = get_visible_cards(ntree, context, frame)
+            draw_board(ntree, cards, frame)
+        profiler.end_frame()
+        if profiler.show_overlay:
+            draw_profiler_overlay(frame)
+
+@persistent
+def free_board_caches(*args):
+    # Undo and file loads reallocate every node, cached node references are stale
+    free_board_indices()
+    free_board_renderers()
+    free_card_batches()
+    free_image_lods()
+    free_atlas()
+    free_texture_budget()
+    free_loader()
+    free_text_metrics()
+    free_tiles()
+    free_feature_indexes()
+    free_composites()
+
+board_cache_handlers = (
+    bpy.app.handlers.load_post,
+    bpy.app.handlers.undo_post,
+    bpy.app.handlers.redo_post,
+)
 
 node_categories = [
     BlendRefCategory('SOMENODES', "Nodes", items=[
@@ -43,12 +92,19 @@ def register():
     nodeitems_utils.register_node_categories('BLENDREF_NODES', node_categories)
     global _handler
     _handler = bpy.types.SpaceNodeEditor.draw_handler_add(draw_handler, (), 'WINDOW', 'POST_PIXEL')
+    for handlers in board_cache_handlers:
+        handlers.append(free_board_caches)
     wm = bpy.context.window_manager
     kc = wm.keyconfigs.addon
     if kc:
         km = kc.keymaps.new(name='Node Editor', space_type='NODE_EDITOR')
         kmi = km.keymap_items.new('blendref.rotate', type='R', value='PRESS', shift=True)
         addon_keymaps.append([km, kmi])
+
+        km = kc.keymaps.new(name='Node Editor', space_type='NODE_EDITOR')
+        kmi = km.keymap_items.new('blendref.rotate', type='R', value='PRESS', shift=True, ctrl=True)
+        kmi.properties.group_pivot = True
+        addon_keymaps.append([km, kmi])
         
         km = kc.keymaps.new(name='Node Editor', space_type='NODE_EDITOR')
         kmi = km.keymap_items.new('blendref.zoom_in', type='Z', value='PRESS', alt=True)
@@ -66,5 +122,9 @@ def register():
 def unregister():
     nodeitems_utils.unregister_node_categories('BLENDREF_NODES')
     bpy.types.SpaceNodeEditor.draw_handler_remove(_handler, 'WINDOW')
+    for handlers in board_cache_handlers:
+        if free_board_caches in handlers:
+            handlers.remove(free_board_caches)
+    free_board_caches()
     for km, kmi in addon_keymaps:
         km.keymap_items.remove(kmi)
\ No newline at end of file
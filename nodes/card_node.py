@@ -1,10 +1,12 @@
 from bpy.types import Node
 from .base_node import BlendRefNode
-from ..utils.draw_utils import draw_card, get_dpi_factor
+from ..utils import lod
+from ..utils.text_metrics import free_text_metrics
+from ..utils.draw_utils import draw_card, get_dpi_factor, get_card_image_size, free_card_batches, remove_card_index, update_card_index
 # from ..ui_widgets.ui_panel import UIPanel
 import bpy
 import time 
-import numpy as np
+from ..utils.lazy_import import numpy as np
 from mathutils import Vector
 
 class CardNode(Node, BlendRefNode):
@@ -16,15 +18,38 @@ class CardNode(Node, BlendRefNode):
     
     def image_update(self, context):
         if self.image:
-            self.width = self.image.size[0] / 8
+            self.image_size = lod.get_image_size(self.image)
+            self.filepath = self.image.filepath
+            self.width = self.image_size[0] / 8
         else:
             self.width = self.bl_width_default
+        update_card_index(self)
     image: bpy.props.PointerProperty(type=bpy.types.Image, update=image_update)
+    # Source of the image, lets a card wait for its pixels until it is first seen
+    filepath: bpy.props.StringProperty(name='File Path', subtype='FILE_PATH')
+    image_size: bpy.props.IntVectorProperty(name='Image Size', size=2)
     
     scale: bpy.props.FloatProperty(name='Scale', default=1)
     rotation: bpy.props.FloatProperty(name='Rotation')
     translation_x: bpy.props.FloatProperty(name='X')
     translation_y: bpy.props.FloatProperty(name='Y')
+    # Set by the watch folder when the file of the card was deleted
+    missing: bpy.props.BoolProperty(name='Missing')
+
+    # Adjustments, evaluated by the card shaders when the image is drawn
+    grayscale: bpy.props.BoolProperty(name='Grayscale')
+    flip_x: bpy.props.BoolProperty(name='Flip X', description='Mirror the image left to right')
+    flip_y: bpy.props.BoolProperty(name='Flip Y', description='Mirror the image top to bottom')
+    brightness: bpy.props.FloatProperty(name='Brightness', default=0, min=-1, max=1)
+    contrast: bpy.props.FloatProperty(name='Contrast', default=0, min=-1, soft_max=2)
+    posterize: bpy.props.IntProperty(name='Posterize', description='Levels per channel, 0 keeps them all', default=0, min=0, max=64)
+    channel: bpy.props.EnumProperty(name='Channel', items=(
+        ('RGB', 'RGB', 'Show the image in color'),
+        ('R', 'R', 'Show the red channel as gray'),
+        ('G', 'G', 'Show the green channel as gray'),
+        ('B', 'B', 'Show the blue channel as gray'),
+        ('A', 'A', 'Show the alpha channel as gray'),
+    ))
     widgets = []
     def __init__(self):
         self.line_height = 10
@@ -35,10 +60,14 @@ class CardNode(Node, BlendRefNode):
     def copy(self, node):
         pass
     def free(self):
-        pass
+        free_card_batches(self)
+        free_text_metrics(self)
+        remove_card_index(self)
 
     def draw_buttons_ext(self, context, layout):
         column = layout.column()
+        if self.missing:
+            column.label(text='File missing', icon='ERROR')
         column.label(text='Source')
         column.template_ID(self, 'image', open='image.open', live_icon=True)
         column.label(text='Scale')
@@ -49,13 +78,26 @@ class CardNode(Node, BlendRefNode):
         row = column.row(align=True)
         row.prop(self, 'translation_x')
         row.prop(self, 'translation_y')
+        column.label(text='Adjustments')
+        row = column.row(align=True)
+        row.prop(self, 'channel', expand=True)
+        row = column.row(align=True)
+        row.prop(self, 'grayscale', toggle=True)
+        row.prop(self, 'flip_x', toggle=True)
+        row.prop(self, 'flip_y', toggle=True)
+        column.prop(self, 'brightness', slider=True)
+        column.prop(self, 'contrast')
+        column.prop(self, 'posterize')
         
     def draw_buttons(self, context, layout):
         row = layout.row()
-        if self.image:
-            w, h = self.image.size
-            offset = np.interp(get_dpi_factor(), [0.5, 1, 2], [18.14697265625, 30.931640625, 60.2490234375])
-            size = np.interp(get_dpi_factor(), [0.5, 1, 2], [12, 20, 40])
+        image_size = get_card_image_size(self)
+        if self.image or image_size:
+            # Cards still waiting for their image keep their final shape
+            w, h = image_size if image_size else lod.get_image_size(self.image)
+            dpiFactor = get_dpi_factor()
+            offset = np.interp(dpiFactor, [0.5, 1, 2], [18.14697265625, 30.931640625, 60.2490234375])
+            size = np.interp(dpiFactor, [0.5, 1, 2], [12, 20, 40])
             try:
                 y = self.dimensions.x * (h / w) - offset
             except:
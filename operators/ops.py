@@ -1,29 +1,91 @@
 import bpy
-import numpy as np
-from bpy.props import IntProperty, FloatProperty
+from ..utils.lazy_import import numpy as np
+from bpy.props import IntProperty, FloatProperty, BoolProperty
 import math
-from mathutils import Vector
+from ..utils import texture_budget, decode, lod, layout, content_hash, profiler, manifest
+from ..utils.probe import probe_size
+from ..utils.draw_utils import get_card_image_size
+from ..utils.loader import tag_node_editors_redraw
+from ..preferences import get_preferences
+import time
 
 def angle(a, b, c):
-    a = np.array(a)
-    b = np.array(b)
-    c = np.array(c)
-    ba = a - b
-    bc = c - b
+    """Angle in degrees swept from a to c around b, clockwise positive"""
+    bax, bay = a[0] - b[0], a[1] - b[1]
+    bcx, bcy = c[0] - b[0], c[1] - b[1]
+    return -math.degrees(math.atan2(bax * bcy - bay * bcx, bax * bcx + bay * bcy))
+
+
+class ThrottledModal:
+    """Mouse moves of a modal operator applied at most once per display refresh.
+
+    MOUSEMOVE only records the cursor. The motion gathered since the last
+    update is applied by apply_motion(), right away when a refresh interval
+    has passed and otherwise on the next timer event, so a high polling rate
+    mouse costs one property update and one redraw per frame.
+    """
+
+    def start_throttle(self, context, event):
+        self.prev_mouse = self.mouse = (event.mouse_x, event.mouse_y)
+        self.interval = 1 / get_preferences().redraw_rate
+        self.last_update = 0.0
+        self.timer = context.window_manager.event_timer_add(self.interval, window=context.window)
+
+    def stop_throttle(self, context):
+        context.window_manager.event_timer_remove(self.timer)
+
+    def throttle(self, context, event):
+        """Handles MOUSEMOVE and TIMER events, returns False for every other event"""
+        if event.type == 'MOUSEMOVE':
+            self.mouse = (event.mouse_x, event.mouse_y)
+            if time.perf_counter() - self.last_update >= self.interval:
+                self.flush(context)
+            return True
+        if event.type == 'TIMER':
+            self.flush(context)
+            return True
+        return False
+
+    def flush(self, context):
+        if self.mouse == self.prev_mouse:
+            return
+        self.apply_motion(context, self.prev_mouse, self.mouse)
+        self.prev_mouse = self.mouse
+        self.last_update = time.perf_counter()
+        context.area.tag_redraw()
+
+def get_selected_cards(context):
+    """Selected cards, or the active card when nothing else is selected"""
+    nodes = [node for node in context.selected_nodes if node.bl_idname == 'CardNode']
+    if not nodes and context.active_node and context.active_node.bl_idname == 'CardNode':
+        nodes = [context.active_node]
+    return nodes
+
+
+def get_card_centers(nodes):
+    """Centers of nodes in node space, as an (n, 2) array"""
+    centers = np.empty((len(nodes), 2))
+    for i, node in enumerate(nodes):
+        centers[i] = (node.location.x + node.dimensions.x / 2, node.location.y - node.dimensions.y / 2)
+    return centers
+
+
+def zoom_cards(nodes, amount):
+    scales = np.array([node.scale for node in nodes]) + amount
+    for node, scale in zip(nodes, np.maximum(scales, 0).tolist()):
+        node.scale = scale
 
-    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
-    angle = np.arccos(cosine_angle)
-    sign = -1 if (b[0] - a[0]) * (c[1] - a[1] ) - (b[1] - a[1]) * (c[0] - a[0]) < 0 else 1
-    return np.degrees(angle) * sign
 
 class ZoomInRefOperator(bpy.types.Operator):
     """ZoomIn Reference Image"""
     bl_idname = "blendref.zoom_in"
     bl_label = "ZoomIn Reference Image"
+    bl_options = {'REGISTER', 'UNDO'}
     
     def execute(self, context):
-        if context.active_node:
-            context.active_node.scale += 0.1
+        nodes = get_selected_cards(context)
+        if nodes:
+            zoom_cards(nodes, 0.1)
             context.area.tag_redraw()
             return {'FINISHED'}
         else:
@@ -34,44 +96,52 @@ class ZoomOutRefOperator(bpy.types.Operator):
     """ZoomOut Reference Image"""
     bl_idname = "blendref.zoom_out"
     bl_label = "ZoomOut Reference Image"
+    bl_options = {'REGISTER', 'UNDO'}
     
     def execute(self, context):
-        if context.active_node:
-            context.active_node.scale -= 0.1
-            if context.active_node.scale < 0:
-                context.active_node.scale = 0
+        nodes = get_selected_cards(context)
+        if nodes:
+            zoom_cards(nodes, -0.1)
             context.area.tag_redraw()
             return {'FINISHED'}
         else:
             self.report({'WARNING'}, "No active object, could not finish")
             return {'CANCELLED'}
 
-class MoveRefOperator(bpy.types.Operator):
+class MoveRefOperator(bpy.types.Operator, ThrottledModal):
     """Move Reference Image"""
     bl_idname = "blendref.move"
     bl_label = "Move Reference Image"
+    bl_options = {'UNDO'}
 
     first_mouse_x: IntProperty()
     first_value: FloatProperty()
     
 
+    def apply_motion(self, context, prev_mouse, mouse):
+        self.translation_x += (prev_mouse[0] - mouse[0]) / 750
+        self.translation_y += (prev_mouse[1] - mouse[1]) / 750
+        self.set_translation(self.translation_x, self.translation_y)
+
+    def set_translation(self, offset_x, offset_y):
+        translations = (self.init_translations + (offset_x, offset_y)).tolist()
+        for node, (x, y) in zip(self.nodes, translations):
+            node.translation_x = x
+            node.translation_y = y
+
     def modal(self, context, event):
-        if event.type == 'MOUSEMOVE':
-            node = context.active_node
-            delta_x = (self.prev_mouse[0] - event.mouse_x) / 750
-            delta_y = (self.prev_mouse[1] - event.mouse_y) / 750
-            self.translation_x += delta_x
-            self.translation_y += delta_y
-            node.translation_x += delta_x
-            node.translation_y += delta_y
-            context.area.tag_redraw()
-            self.prev_mouse = (event.mouse_x, event.mouse_y)
-            
+        if self.throttle(context, event):
+            pass
+
         elif event.type in {'LEFTMOUSE', 'RET', 'NUMPAD_ENTER'}:
+            self.flush(context)
+            self.stop_throttle(context)
             context.area.tag_redraw()
             return {'FINISHED'}
 
         elif event.type in {'RIGHTMOUSE', 'ESC'}:
+            self.stop_throttle(context)
+            self.set_translation(0, 0)
             context.area.tag_redraw()
             return {'CANCELLED'}
         
@@ -79,12 +149,12 @@ class MoveRefOperator(bpy.types.Operator):
         return {'RUNNING_MODAL'}
 
     def invoke(self, context, event):
-        if context.active_node:
-            self.prev_mouse = (event.mouse_x, event.mouse_y)
-            self.init_x = context.active_node.translation_x
-            self.init_y = context.active_node.translation_y
+        self.nodes = get_selected_cards(context)
+        if self.nodes:
+            self.init_translations = np.array([(node.translation_x, node.translation_y) for node in self.nodes])
             self.translation_x = 0
             self.translation_y = 0
+            self.start_throttle(context, event)
             context.window_manager.modal_handler_add(self)
             return {'RUNNING_MODAL'}
         else:
@@ -92,32 +162,49 @@ class MoveRefOperator(bpy.types.Operator):
             return {'CANCELLED'}
 
         
-class RotateRefOperator(bpy.types.Operator):
+class RotateRefOperator(bpy.types.Operator, ThrottledModal):
     """Rotate Reference Image"""
     bl_idname = "blendref.rotate"
     bl_label = "Rotate Reference Image"
+    bl_options = {'UNDO'}
 
     first_mouse_x: IntProperty()
     first_value: FloatProperty()
+    group_pivot: BoolProperty(
+        name='Group Pivot',
+        description='Also turn the selected cards around the center of the selection',
+        default=False,
+    )
     
 
+    def apply_motion(self, context, prev_mouse, mouse):
+        self.rotation += angle(prev_mouse, self.pivot, mouse)
+        self.set_rotation(self.rotation)
+        context.area.header_text_set("Rotation : %.4f" % self.rotation)
+
+    def set_rotation(self, rotation):
+        for node, value in zip(self.nodes, (self.init_rotations - rotation).tolist()):
+            node.rotation = value
+        if not self.group_pivot:
+            return
+        # Rotation is clockwise, from the starting positions so the cards never drift
+        theta = math.radians(rotation)
+        cos_theta, sin_theta = math.cos(theta), math.sin(theta)
+        offsets = self.init_centers - self.center
+        centers = np.empty_like(offsets)
+        centers[:, 0] = offsets[:, 0] * cos_theta + offsets[:, 1] * sin_theta
+        centers[:, 1] = offsets[:, 1] * cos_theta - offsets[:, 0] * sin_theta
+        locations = (centers + self.center - self.half_sizes).tolist()
+        for node, location in zip(self.nodes, locations):
+            node.location = location
+
     def modal(self, context, event):
-        if event.type == 'MOUSEMOVE':
-            if self.text_mode:
-                return {'RUNNING_MODAL'}
-            context.area.header_text_set("Rotation : %.4f" % self.rotation)
-            node = context.active_node
-            center = Vector((0,0))
-            center.x = node.location.x + (node.dimensions / 2).x
-            center.y = node.location.y - (node.dimensions / 2).y
-            pivot = context.region.view2d.view_to_region(center.x, center.y)
-            delta = angle(self.prev_mouse, pivot, (event.mouse_x, event.mouse_y))
-            if not math.isnan(delta):
-                node.rotation -= delta
-                self.rotation += delta
-            context.area.tag_redraw()
-            self.prev_mouse = (event.mouse_x, event.mouse_y)
-            
+        if event.type in {'MOUSEMOVE', 'TIMER'} and self.text_mode:
+            return {'RUNNING_MODAL'}
+
+        if self.throttle(context, event):
+            pass
+
         elif event.type in ['NUMPAD_1', 'NUMPAD_2', 'NUMPAD_3', 'NUMPAD_4', 'NUMPAD_5', 'NUMPAD_6', 'NUMPAD_7', 'NUMPAD_8', 'NUMPAD_9', 'NUMPAD_0', 'NUMPAD_PERIOD', 'PERIOD', 'BACK_SPACE', 'NUMPAD_MINUS'] and event.value == 'PRESS':
             numap = {'NUMPAD_1':'1', 'NUMPAD_2':'2', 'NUMPAD_3':'3', 'NUMPAD_4':'4', 'NUMPAD_5':'5', 'NUMPAD_6':'6', 'NUMPAD_7':'7', 'NUMPAD_8':'8', 'NUMPAD_9':'9', 'NUMPAD_0':'0', 'NUMPAD_PERIOD':'.', 'PERIOD':'.'}
             self.text_mode = True
@@ -128,18 +215,20 @@ class RotateRefOperator(bpy.types.Operator):
                 self.sign *= -1
             else:
                 self.text += numap[event.type]
-            node = context.active_node
-            node.rotation += self.rotation
-            node.rotation -= float(self.text) * self.sign 
             self.rotation = float(self.text) * self.sign
+            self.set_rotation(self.rotation)
             context.area.header_text_set("Rotation : %.4f" % (float(self.text) * self.sign))
             context.area.tag_redraw()
         elif event.type in {'LEFTMOUSE', 'RET', 'NUMPAD_ENTER'}:
+            if not self.text_mode:
+                self.flush(context)
+            self.stop_throttle(context)
             context.area.header_text_set(None)
             return {'FINISHED'}
 
         elif event.type in {'RIGHTMOUSE', 'ESC'}:
-            context.active_node.rotation = self.init_rotation
+            self.stop_throttle(context)
+            self.set_rotation(0)
             context.area.tag_redraw()
             context.area.header_text_set(None)
             return {'CANCELLED'}
@@ -148,11 +237,22 @@ class RotateRefOperator(bpy.types.Operator):
         return {'RUNNING_MODAL'}
 
     def invoke(self, context, event):
-        if context.active_node:
-            self.prev_mouse = (event.mouse_x, event.mouse_y)
-            self.init_rotation = context.active_node.rotation
+        self.nodes = get_selected_cards(context)
+        if self.nodes:
+            self.init_rotations = np.array([node.rotation for node in self.nodes])
+            self.init_centers = get_card_centers(self.nodes)
+            self.half_sizes = np.array([(node.dimensions.x / 2, -node.dimensions.y / 2) for node in self.nodes])
+            if self.group_pivot:
+                self.center = (self.init_centers.min(axis=0) + self.init_centers.max(axis=0)) / 2
+            elif context.active_node in self.nodes:
+                self.center = self.init_centers[self.nodes.index(context.active_node)]
+            else:
+                self.center = self.init_centers[0]
             self.rotation = 0
             self.text = '0'
+            # The pivot does not move while rotating, it is projected once
+            self.pivot = context.region.view2d.view_to_region(*self.center.tolist())
+            self.start_throttle(context, event)
             context.window_manager.modal_handler_add(self)
             self.text_mode = False
             self.sign = 1
@@ -162,75 +262,403 @@ class RotateRefOperator(bpy.types.Operator):
             return {'CANCELLED'}
 
 
-from bpy_extras.io_utils import ImportHelper
+class TextureReportBlendRef(bpy.types.Operator):
+    """Print the card textures resident on the GPU and their sizes"""
+    bl_idname = "blendref.texture_report"
+    bl_label = "BlendRef Texture Report"
+
+    def execute(self, context):
+        textures = texture_budget.get_resident_textures()
+        for name, (width, height), size_bytes in textures:
+            print("%s %dx%d %.2f MB" % (name, width, height, size_bytes / 2**20))
+        count, used = texture_budget.get_resident_stats()
+        self.report({'INFO'}, "%d textures resident, %.1f MB" % (count, used / 2**20))
+        return {'FINISHED'}
+
+
+class ProfilerToggleBlendRef(bpy.types.Operator):
+    """Record BlendRef draw timings and show them over the node editor"""
+    bl_idname = "blendref.profiler_toggle"
+    bl_label = "Toggle BlendRef Profiler"
+
+    def execute(self, context):
+        profiler.enabled = not profiler.enabled
+        profiler.show_overlay = profiler.enabled
+        if profiler.enabled:
+            profiler.clear()
+        tag_node_editors_redraw()
+        return {'FINISHED'}
+
+
+from bpy_extras.io_utils import ImportHelper, ExportHelper
+
 
-def separate_thread(self, context):
-    from time import sleep
-    for i in range(100):
-        sleep(0.1)
-        self.report({'INFO'}, f"{i}%")
-    self.report({'INFO'}, "100% Finished")
-    self.finished = True
+class ProfilerExportBlendRef(bpy.types.Operator, ExportHelper):
+    """Save the recorded BlendRef draw timings as CSV or JSON"""
+    bl_idname = "blendref.profiler_export"
+    bl_label = "Export BlendRef Profile"
+
+    filename_ext = ".csv"
+    filter_glob: bpy.props.StringProperty(default="*.csv;*.json", options={'HIDDEN'})
+
+    def check(self, context):
+        # Keep a .json extension the user typed instead of forcing .csv
+        if self.filepath.lower().endswith('.json'):
+            return False
+        return super().check(context)
+
+    def execute(self, context):
+        count = profiler.export(self.filepath)
+        self.report({'INFO'}, "Exported %d frames" % count)
+        return {'FINISHED'}
 
 import os
+import queue
+
+# Seconds of main thread work per timer tick while importing
+DRAIN_BUDGET = 0.02
+
+
+def create_card(ntree, result):
+    img = bpy.data.images.load(result.path, check_existing=True)
+    if result.size is not None:
+        lod.set_image_size(img, result.size)
+    if result.thumbnail is not None:
+        lod.add_proxy(img, result.thumbnail)
+    node = ntree.nodes.new('CardNode')
+    node.image = img
+    return node
+
+
+def layout_cards(nodes, mode='SHELF', row_width=0, spacing=20):
+    """Lay nodes out in one pass, keeping the top left corner of their bounding box"""
+    if len(nodes) == 0:
+        return
+    widths = np.empty(len(nodes))
+    heights = np.empty(len(nodes))
+    for i, node in enumerate(nodes):
+        widths[i] = node.width
+        size = get_card_image_size(node)
+        if size is None and node.image:
+            size = lod.get_image_size(node.image)
+        heights[i] = layout.HEADER_HEIGHT + (node.width * size[1] / size[0] if size else 0)
+
+    x, y, widths = layout.compute_layout(mode, widths, heights, row_width, spacing)
+    left = min(node.location.x for node in nodes)
+    top = max(node.location.y for node in nodes)
+    resize = mode == 'JUSTIFIED'
+    for node, nx, ny, width in zip(nodes, (x + left).tolist(), (top - y).tolist(), widths.tolist()):
+        if resize:
+            node.width = width
+        node.location = (nx, ny)
+
+
+class LayoutRefOperator(bpy.types.Operator):
+    """Lay out the selected reference cards"""
+    bl_idname = "blendref.layout"
+    bl_label = "Layout Selected Cards"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    mode: bpy.props.EnumProperty(name='Mode', items=layout.LAYOUT_MODES, default='SHELF')
+    spacing: FloatProperty(name='Spacing', default=20, min=0)
+    row_width: FloatProperty(name='Row Width', description='Width of a row, 0 picks one for a square board', default=0, min=0)
+
+    @classmethod
+    def poll(cls, context):
+        return context.space_data.type == 'NODE_EDITOR' and context.space_data.edit_tree is not None
+
+    def execute(self, context):
+        nodes = [node for node in context.selected_nodes if node.bl_idname == 'CardNode']
+        if not nodes:
+            self.report({'WARNING'}, "No cards selected, could not finish")
+            return {'CANCELLED'}
+        # Keep the reading order the cards already have
+        nodes.sort(key=lambda node: (-node.location.y, node.location.x))
+        layout_cards(nodes, self.mode, self.row_width, self.spacing)
+        context.area.tag_redraw()
+        return {'FINISHED'}
+
+
+def get_loaded_digests(index):
+    """Content hash -> path of the file images already in the blend file were loaded from"""
+    digests = {}
+    for image in bpy.data.images:
+        if image.source == 'FILE' and not image.packed_file:
+            path = bpy.path.abspath(image.filepath, library=image.library)
+            digest = index.lookup(path)
+            if digest is not None:
+                digests.setdefault(digest, path)
+    return digests
 
-def load_images(self, context, filepaths):
-    print('Entered')
-    ntree = context.space_data.edit_tree
-    # ntree = bpy.data.node_groups[self.ntree]
+
+class ImportJob:
+    """Decodes files on the worker pool and turns them into cards on the main thread.
+
+    Workers first hash and probe every file. Files with the same content are
+    loaded once and share one image. Cards whose size could be probed are
+    created and laid out right away, their thumbnails arrive later. Decode
+    results are pushed into a queue that a bpy.app.timers callback drains in
+    slices of DRAIN_BUDGET seconds so the UI keeps running during the import.
+    """
+
+    def __init__(self, ntree, filepaths):
+        self.ntree_name = ntree.name
+        self.filepaths = filepaths
+        self.results = queue.Queue()
+        self.inspections = None
+        # Path -> path of the file actually loaded for it, and the reverse
+        self.sources = {}
+        self.copies = {}
+        self.node_names = {}
+        self.decodes = None
+        self.done = 0
+        self.failed = 0
+        self.late_cards = False
+        self.saved_bytes = 0
+        self.saved_decodes = 0
+
+    @property
+    def finished(self):
+        return self.decodes is not None and self.done == len(self.decodes)
+
+    def inspect(self):
+        index = content_hash.get_hash_index()
+        executor = decode.get_executor()
+        self.inspections = [executor.submit(content_hash.inspect_file, path, index.get(path))
+                            for path in self.filepaths]
+
+    def create_cards(self):
+        ntree = bpy.data.node_groups.get(self.ntree_name)
+        index = content_hash.get_hash_index()
+        known = get_loaded_digests(index)
+        for path, inspection in zip(self.filepaths, self.inspections):
+            if path in self.sources:
+                continue
+            info = inspection.result()
+            index.store(info)
+            source = path
+            if info.digest is not None:
+                source = known.setdefault(info.digest, path)
+            self.sources[path] = source
+            self.copies.setdefault(source, []).append(path)
+            if source != path:
+                self.saved_bytes += info.file_size
+                self.saved_decodes += 1
+            # Duplicates share the image of their source, there is no decode of their own to wait for
+            if info.size is not None or source != path:
+                card = create_card(ntree, decode.DecodeResult(source, info.size))
+                self.node_names[path] = card.name
+        index.save()
+        layout_cards(self.get_nodes(ntree))
+
+        self.decodes = [path for path in self.filepaths if self.sources[path] == path]
+        decode.submit(self.decodes, lod.LOD_LEVELS[0], self.results.put)
+
+    def get_nodes(self, ntree):
+        by_name = {node.name: node for node in ntree.nodes}
+        return [by_name[self.node_names[path]] for path in self.filepaths
+                if self.node_names.get(path) in by_name]
+
+    def start(self):
+        self.inspect()
+        bpy.context.window_manager.progress_begin(0, len(self.filepaths))
+        bpy.app.timers.register(self.drain, first_interval=0.01)
+
+    def run(self):
+        """Import synchronously, for scripts and background mode"""
+        self.inspect()
+        self.create_cards()
+        ntree = bpy.data.node_groups.get(self.ntree_name)
+        while not self.finished:
+            self.add_result(ntree, self.results.get())
+        self.finish()
+
+    def add_result(self, ntree, result):
+        self.done += 1
+        if result.error is not None or ntree is None:
+            print('Could not load ' + result.path, result.error)
+            # A probed card stays, the loader retries when it is seen
+            self.failed += result.path not in self.node_names
+            return
+        for path in self.copies[result.path]:
+            name = self.node_names.get(path)
+            if name is None:
+                self.node_names[path] = create_card(ntree, result).name
+                self.late_cards = True
+            elif result.thumbnail is not None:
+                node = ntree.nodes.get(name)
+                if node is not None and node.image:
+                    lod.add_proxy(node.image, result.thumbnail)
+                    result.thumbnail = None
+
+    def drain_results(self):
+        ntree = bpy.data.node_groups.get(self.ntree_name)
+        deadline = time.perf_counter() + DRAIN_BUDGET
+        while not self.finished and time.perf_counter() < deadline:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.add_result(ntree, result)
+
+    def drain(self):
+        if self.decodes is None:
+            if not all(inspection.done() for inspection in self.inspections):
+                return 0.05
+            self.create_cards()
+        self.drain_results()
+        bpy.context.window_manager.progress_update(self.done + len(self.filepaths) - len(self.decodes))
+        tag_node_editors_redraw()
+        if self.finished:
+            bpy.context.window_manager.progress_end()
+            self.finish()
+            return None
+        return 0.05
+
+    def finish(self):
+        ntree = bpy.data.node_groups.get(self.ntree_name)
+        if ntree is not None and self.late_cards:
+            layout_cards(self.get_nodes(ntree))
+        summary = "Imported %d images, %d failed" % (len(self.filepaths) - self.failed, self.failed)
+        if self.saved_decodes:
+            # Every duplicate is one decode saved
+            summary += ", %d duplicates shared an image, saving %.1f MB" % (
+                self.saved_decodes, self.saved_bytes / 2**20)
+        print(summary)
+        show_report(summary, 'WARNING' if self.failed else 'INFO')
+
+
+def show_report(message, kind='INFO'):
+    """Report message in the status bar from outside an operator, e.g. at the end of a background job"""
+    windows = bpy.context.window_manager.windows
+    if bpy.app.background or not windows:
+        return
+    window = windows[0]
+    if hasattr(bpy.context, 'temp_override'):
+        with bpy.context.temp_override(window=window, screen=window.screen):
+            bpy.ops.blendref.report(message=message, kind=kind)
+    else:
+        # Blender before 3.2 only takes the override dict
+        bpy.ops.blendref.report({'window': window, 'screen': window.screen}, message=message, kind=kind)
+
+
+class ReportBlendRef(bpy.types.Operator):
+    """Show a message in the status bar"""
+    bl_idname = "blendref.report"
+    bl_label = "Report"
+    bl_options = {'INTERNAL'}
+
+    message: bpy.props.StringProperty()
+    kind: bpy.props.EnumProperty(items=(('INFO', 'Info', ''), ('WARNING', 'Warning', '')))
+
+    def execute(self, context):
+        self.report({self.kind}, self.message)
+        return {'FINISHED'}
+
+
+def load_images(ntree, filepaths, background=False):
+    job = ImportJob(ntree, filepaths)
+    if background:
+        job.start()
+    else:
+        job.run()
+    return job
+
+def get_manifest_cards(nodes):
+    cards = []
+    for node in nodes:
+        path = node.filepath or (node.image.filepath if node.image else '')
+        if not path or (node.image and node.image.packed_file):
+            continue
+        library = node.image.library if node.image else None
+        width, height = get_card_image_size(node) or (0, 0)
+        cards.append(manifest.ManifestCard(
+            path=bpy.path.abspath(path, library=library), x=node.location.x, y=node.location.y,
+            width=node.width, scale=node.scale, rotation=node.rotation, translation_x=node.translation_x,
+            translation_y=node.translation_y, label=node.label, image_width=width, image_height=height,
+        ))
+    return cards
+
+
+def create_manifest_cards(ntree, cards):
+    """Create a card per ManifestCard.
+
+    Cards only get their path and size, image is never set so image_update
+    does not run for any of them. The loader assigns the images once the
+    cards are first seen, closest to the middle of the view first.
+    """
+    unknown = [card for card in cards if not card.image_width or not card.image_height]
+    for card, size in zip(unknown, decode.get_executor().map(probe_size, [card.path for card in unknown])):
+        if size is not None:
+            card.image_width, card.image_height = size
     nodes = []
-    for i, file_elem in enumerate(filepaths):
-        print('Loading ' + file_elem)
-        self.report({'INFO'}, f"{int(i*100/len(filepaths))}%")
-        img = bpy.data.images.load(file_elem, check_existing=True)
+    for card in cards:
         node = ntree.nodes.new('CardNode')
-        node.image = img
+        node.filepath = card.path
+        node.image_size = (card.image_width or 0, card.image_height or 0)
+        node.width = card.width if card.width else (card.image_width or 0) / 8 or node.bl_width_default
+        node.location = (card.x or 0, card.y or 0)
+        node.scale = 1 if card.scale is None else card.scale
+        node.rotation = card.rotation or 0
+        node.translation_x = card.translation_x or 0
+        node.translation_y = card.translation_y or 0
+        node.label = card.label or ''
         nodes.append(node)
-        
-    
-    if len(nodes) > 0:
-        node = nodes[0]
-        prev_node = node
-        max_height = node.width * node.image.size[1] / node.image.size[0]
-        height = 0
-        for i, cnode in enumerate(nodes[1:]):
-            cnode.location.x = prev_node.location.x + prev_node.width + 10
-            cnode.location.y = node.location.y - height - 20
-            max_height = max(cnode.width * cnode.image.size[1] / cnode.image.size[0], max_height)
-            prev_node = cnode
-            
-            if i % 10 == 0:
-                height += max_height
-                max_height = 0
-                prev_node = node
-            
-    self.report({'INFO'}, "100% Finished")
-    self.finished = True
-
-class StringProp(bpy.types.PropertyGroup):
-    filename: bpy.props.StringProperty()
-
-class WM_OT_dummy_progress(bpy.types.Operator):
-    bl_idname = 'wm.dummy_progress'
-    bl_label = 'Dummy Progress'
-    files : bpy.props.CollectionProperty(name='File Paths', type=StringProp)
-    ntree: bpy.props.StringProperty(name='Node Tree')
-    
-    def modal(self, context, event):
-        if self.finished:
-            return {'FINISHED'}
+    return nodes
+
+
+class ExportBoardBlendRef(bpy.types.Operator, ExportHelper):
+    """Save the cards of the board to a manifest file"""
+    bl_idname = "blendref.export_board"
+    bl_label = "Export Board Manifest"
+
+    filename_ext = ".json"
+    filter_glob: bpy.props.StringProperty(default="*.json", options={'HIDDEN'})
+    selected_only: BoolProperty(name='Selected Only', description='Only export the selected cards', default=False)
+
+    @classmethod
+    def poll(cls, context):
+        return context.space_data.type == 'NODE_EDITOR' and context.space_data.edit_tree is not None
+
+    def execute(self, context):
+        ntree = context.space_data.edit_tree
+        nodes = context.selected_nodes if self.selected_only else ntree.nodes
+        nodes = [node for node in nodes if node.bl_idname == 'CardNode']
+        cards = get_manifest_cards(nodes)
+        count = manifest.write_manifest(self.filepath, cards)
+        if count < len(nodes):
+            self.report({'WARNING'}, "Exported %d cards, %d without an image file were skipped" % (count, len(nodes) - count))
         else:
-            return {'PASS_THROUGH'}
-        
-    def invoke(self, context, event):
-        self.finished = False
-        from threading import Timer
-        Timer(0, load_images, (self, context)).start()
-        wm = context.window_manager
-        wm.modal_handler_add(self)
-        return {'RUNNING_MODAL'}
-    
-    
+            self.report({'INFO'}, "Exported %d cards" % count)
+        return {'FINISHED'}
+
+
+class ImportBoardBlendRef(bpy.types.Operator, ImportHelper):
+    """Add the cards of a board manifest file"""
+    bl_idname = "blendref.import_board"
+    bl_label = "Import Board Manifest"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filename_ext = ".json"
+    filter_glob: bpy.props.StringProperty(default="*.json", options={'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return context.space_data.type == 'NODE_EDITOR' and context.space_data.edit_tree is not None
+
+    def execute(self, context):
+        try:
+            cards = manifest.read_manifest(self.filepath)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.report({'ERROR'}, "Could not read %s: %s" % (self.filepath, e))
+            return {'CANCELLED'}
+        start = time.perf_counter()
+        nodes = create_manifest_cards(context.space_data.edit_tree, cards)
+        self.report({'INFO'}, "Imported %d cards in %.2f s" % (len(nodes), time.perf_counter() - start))
+        context.area.tag_redraw()
+        return {'FINISHED'}
+
+
 class ImportImageBlendRef(bpy.types.Operator, ImportHelper):
     """Import Image into BlendRef"""
     bl_idname = "blendref.import_image" 
@@ -249,19 +677,22 @@ class ImportImageBlendRef(bpy.types.Operator, ImportHelper):
         for f in self.files:
             filepath = os.path.join(self.directory, f.name)
             filepaths.append(filepath)
-        # bpy.ops.wm.dummy_progress('INVOKE_DEFAULT',files=filepaths, ntree=context.space_data.edit_tree.name)
-        load_images(self, context, filepaths)
+        load_images(context.space_data.edit_tree, filepaths, background=True)
+        self.report({'INFO'}, "Importing %d images" % len(filepaths))
         return {'FINISHED'}
 
 def menu_func_import(self, context):
     if context.space_data.tree_type == 'BlendRefTreeType':
-        col = self.layout.column()
-        col.operator(ImportImageBlendRef.bl_idname, text="Import Images")
-        col.enabled = context.space_data.edit_tree is not None 
-        # self.layout.operator(WM_OT_dummy_progress.bl_idname, text='Dummy Progress')
+        row = self.layout.row(align=True)
+        row.operator(ImportImageBlendRef.bl_idname, text="Import Images")
+        row.operator(LayoutRefOperator.bl_idname, text="Layout")
+        row.operator(ImportBoardBlendRef.bl_idname, text="Import Board")
+        row.operator(ExportBoardBlendRef.bl_idname, text="Export Board")
+        row.enabled = context.space_data.edit_tree is not None 
 def register():
     bpy.types.NODE_HT_header.append(menu_func_import)
 
 
 def unregister():
-    bpy.types.NODE_HT_header.remove(menu_func_import)
\ No newline at end of file
+    bpy.types.NODE_HT_header.remove(menu_func_import)
+    decode.shutdown_executor()
\ No newline at end of file
@@ -0,0 +1,284 @@
+import bpy
+import os
+import queue
+import time
+from bpy.props import StringProperty, BoolProperty, FloatProperty, FloatVectorProperty, IntProperty, EnumProperty
+from ..utils.lazy_import import numpy as np
+from ..utils import decode, features, lod
+from ..utils.atlas import read_pixels
+from .ops import DRAIN_BUDGET
+from .watch import get_card_path
+
+# Node tree name -> FeatureJob indexing it
+_jobs = {}
+
+
+def compute_file_features(path):
+    """(path, ImageFeatures or None) from the smallest proxy, runs on a worker"""
+    result = decode.decode(path, lod.LOD_LEVELS[0])
+    if result.thumbnail is None:
+        return path, None
+    try:
+        return path, features.compute_features(result.thumbnail)
+    except Exception as e:
+        print('Could not index ' + path, e)
+        return path, None
+
+
+def tag_sidebars_redraw():
+    # Only the progress changed, the board itself looks the same
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'NODE_EDITOR':
+                for region in area.regions:
+                    if region.type == 'UI':
+                        region.tag_redraw()
+
+
+def get_resident_pixels(image):
+    """Pixels of the smallest proxy of image already in Blender, or of the image itself when small"""
+    proxies = lod.get_image_lod(image).proxies
+    if proxies:
+        return read_pixels(proxies[min(proxies)])
+    if image.has_data and max(image.size) <= lod.LOD_LEVELS[-1]:
+        return read_pixels(image)
+    return None
+
+
+class FeatureJob:
+    """Computes search features of card files on the worker pool, a timer stores them on the node tree.
+
+    Workers read the smallest proxy from the disk cache or decode one with
+    Pillow. Without Pillow a card falls back to a proxy that is already
+    loaded in Blender, cards without one are left for a later run.
+    """
+
+    def __init__(self, ntree, stamps, images):
+        self.ntree_name = ntree.name
+        # Path -> stamp of the file when the job started, and name of its image
+        self.stamps = stamps
+        self.images = images
+        self.results = queue.Queue()
+        self.done = 0
+        self.skipped = 0
+
+    @property
+    def finished(self):
+        return self.done + self.skipped == len(self.stamps)
+
+    def start(self):
+        executor = decode.get_executor()
+        for path in self.stamps:
+            executor.submit(compute_file_features, path).add_done_callback(
+                lambda future: self.results.put(future.result()))
+        _jobs[self.ntree_name] = self
+        bpy.app.timers.register(self.drain, first_interval=0.05)
+
+    def get_fallback(self, path):
+        image = bpy.data.images.get(self.images.get(path, ''))
+        if image is None:
+            return None
+        pixels = get_resident_pixels(image)
+        return features.compute_features(pixels) if pixels is not None else None
+
+    def drain(self):
+        ntree = bpy.data.node_groups.get(self.ntree_name)
+        deadline = time.perf_counter() + DRAIN_BUDGET
+        while not self.finished and time.perf_counter() < deadline:
+            try:
+                path, result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if result is None and ntree is not None:
+                result = self.get_fallback(path)
+            if result is None or ntree is None:
+                self.skipped += 1
+                continue
+            features.store_features(ntree, path, self.stamps[path], result)
+            self.done += 1
+        tag_sidebars_redraw()
+        if not self.finished:
+            return 0.05
+        print("Indexed %d images, %d skipped" % (self.done, self.skipped))
+        if _jobs.get(self.ntree_name) is self:
+            del _jobs[self.ntree_name]
+        return None
+
+
+def index_tree(ntree):
+    """Start indexing the cards of ntree whose features are missing or older than their file"""
+    stamps = {}
+    images = {}
+    for node in ntree.nodes:
+        if node.bl_idname != 'CardNode':
+            continue
+        path = get_card_path(node)
+        if path is None or path in stamps:
+            continue
+        stamp = features.get_stamp(path)
+        if stamp is None or not features.needs_features(ntree, path, stamp):
+            continue
+        stamps[path] = stamp
+        if node.image is not None:
+            images[path] = node.image.name
+    if stamps:
+        FeatureJob(ntree, stamps, images).start()
+    return len(stamps)
+
+
+def is_board(context):
+    space = context.space_data
+    return space.type == 'NODE_EDITOR' and space.tree_type == 'BlendRefTreeType' and space.edit_tree is not None
+
+
+def select_cards(context, ntree, nodes, extend, frame):
+    if not extend:
+        for node in ntree.nodes:
+            node.select = False
+    for node in nodes:
+        node.select = True
+    if nodes:
+        ntree.nodes.active = nodes[0]
+        if frame:
+            bpy.ops.node.view_selected()
+
+
+class IndexFeaturesBlendRef(bpy.types.Operator):
+    """Compute the colors and hashes used to search the cards, in the background"""
+    bl_idname = "blendref.index_features"
+    bl_label = "Index Cards"
+
+    @classmethod
+    def poll(cls, context):
+        return is_board(context) and context.space_data.edit_tree.name not in _jobs
+
+    def execute(self, context):
+        count = index_tree(context.space_data.edit_tree)
+        if count:
+            self.report({'INFO'}, "Indexing %d images" % count)
+        else:
+            self.report({'INFO'}, "All cards are indexed")
+        return {'FINISHED'}
+
+
+class SearchCardsBlendRef(bpy.types.Operator):
+    """Select the cards whose file name or label contains a text and that show a color"""
+    bl_idname = "blendref.search_cards"
+    bl_label = "Search Cards"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    text: StringProperty(name="Text", description="Part of the file name or label, case is ignored")
+    use_color: BoolProperty(name="Match Color", default=False)
+    # Features come from the stored pixel values, which are not linear
+    color: FloatVectorProperty(name="Color", subtype='COLOR_GAMMA', size=3, min=0.0, max=1.0, default=(1.0, 0.0, 0.0))
+    tolerance: FloatProperty(name="Tolerance", default=0.2, min=0.0, max=1.0, description="Largest RGB distance to a dominant color")
+    extend: BoolProperty(name="Extend", default=False, description="Add to the selection")
+    frame: BoolProperty(name="Frame", default=True, description="Frame the cards found")
+
+    @classmethod
+    def poll(cls, context):
+        return is_board(context)
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        ntree = context.space_data.edit_tree
+        start = time.perf_counter()
+        colored = None
+        if self.use_color:
+            index = features.get_feature_index(ntree, get_card_path)
+            if not len(index):
+                self.report({'WARNING'}, "No card is indexed yet, run Index Cards first")
+                return {'CANCELLED'}
+            colored = {index.names[row] for row in np.flatnonzero(index.match_color(self.color, self.tolerance))}
+        text = self.text.strip().lower()
+        nodes = []
+        for node in ntree.nodes:
+            if node.bl_idname != 'CardNode' or (colored is not None and node.name not in colored):
+                continue
+            if text and text not in node.label.lower() and text not in os.path.basename(get_card_path(node) or '').lower():
+                continue
+            nodes.append(node)
+        elapsed = time.perf_counter() - start
+
+        select_cards(context, ntree, nodes, self.extend, self.frame)
+        self.report({'INFO'}, "%d cards found in %.2f ms" % (len(nodes), elapsed * 1000))
+        return {'FINISHED'}
+
+
+class FindSimilarBlendRef(bpy.types.Operator):
+    """Select the cards that look like the active one"""
+    bl_idname = "blendref.find_similar"
+    bl_label = "Find Similar"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    mode: EnumProperty(name="Mode", items=(
+        ('DUPLICATES', "Near Duplicates", "Cards whose perceptual hash differs in at most Distance bits"),
+        ('SIMILAR', "Similar Colors", "The cards with the closest color histograms"),
+    ))
+    max_distance: IntProperty(name="Distance", default=10, min=0, max=64)
+    count: IntProperty(name="Count", default=12, min=1)
+    extend: BoolProperty(name="Extend", default=False, description="Add to the selection")
+    frame: BoolProperty(name="Frame", default=True, description="Frame the cards found")
+
+    @classmethod
+    def poll(cls, context):
+        return is_board(context) and context.active_node is not None and context.active_node.bl_idname == 'CardNode'
+
+    def execute(self, context):
+        ntree = context.space_data.edit_tree
+        active = context.active_node
+        start = time.perf_counter()
+        index = features.get_feature_index(ntree, get_card_path)
+        row = index.rows.get(active.name)
+        if row is None:
+            self.report({'WARNING'}, "The active card is not indexed yet, run Index Cards first")
+            return {'CANCELLED'}
+        if self.mode == 'DUPLICATES':
+            rows = index.near_duplicates(row, self.max_distance)
+        else:
+            rows = index.most_similar(row, self.count)
+        names = [index.names[i] for i in rows.tolist()]
+        elapsed = time.perf_counter() - start
+
+        # The active card comes first and stays active
+        nodes = [active] + [ntree.nodes[name] for name in names if name != active.name and name in ntree.nodes]
+        select_cards(context, ntree, nodes, self.extend, self.frame)
+        self.report({'INFO'}, "%d similar cards found in %.2f ms" % (len(nodes) - 1, elapsed * 1000))
+        return {'FINISHED'}
+
+
+class CardSearchPanel(bpy.types.Panel):
+    """Find cards by name, color or look"""
+    bl_idname = "BLENDREF_PT_card_search"
+    bl_label = "Search"
+    bl_space_type = 'NODE_EDITOR'
+    bl_region_type = 'UI'
+    bl_category = 'BlendRef'
+
+    @classmethod
+    def poll(cls, context):
+        return is_board(context)
+
+    def draw(self, context):
+        ntree = context.space_data.edit_tree
+        layout = self.layout
+        layout.operator(SearchCardsBlendRef.bl_idname, icon='VIEWZOOM')
+        row = layout.row(align=True)
+        row.operator(FindSimilarBlendRef.bl_idname, text="Duplicates").mode = 'DUPLICATES'
+        row.operator(FindSimilarBlendRef.bl_idname, text="Similar").mode = 'SIMILAR'
+        layout.operator(IndexFeaturesBlendRef.bl_idname)
+        job = _jobs.get(ntree.name)
+        if job is not None:
+            layout.label(text="Indexing %d / %d" % (job.done + job.skipped, len(job.stamps)))
+        else:
+            layout.label(text="%d cards indexed" % len(features.get_feature_index(ntree, get_card_path)))
+
+
+def unregister():
+    for job in _jobs.values():
+        if bpy.app.timers.is_registered(job.drain):
+            bpy.app.timers.unregister(job.drain)
+    _jobs.clear()
+    features.free_feature_indexes()
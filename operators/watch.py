@@ -0,0 +1,131 @@
+import bpy
+import os
+from ..utils import lod, atlas, texture_budget, loader, tiles
+from ..utils.watch import FolderIndex
+from ..utils.probe import probe_size
+from ..utils.loader import tag_node_editors_redraw
+from .ops import load_images
+
+# Seconds between two looks at the watch folders
+WATCH_INTERVAL = 1.0
+
+# Node tree name -> FolderIndex of its watch folder
+_indexes = {}
+
+
+def get_card_path(node):
+    path = node.filepath or (node.image.filepath if node.image else '')
+    if not path:
+        return None
+    library = node.image.library if node.image else None
+    return os.path.normpath(bpy.path.abspath(path, library=library))
+
+
+def get_cards_by_path(ntree):
+    cards = {}
+    for node in ntree.nodes:
+        if node.bl_idname == 'CardNode':
+            path = get_card_path(node)
+            if path is not None:
+                cards.setdefault(path, []).append(node)
+    return cards
+
+
+def reload_image(image, size):
+    # Proxies, atlas cell, tiles and GPU texture all hold the old pixels
+    lod.free_image_lod(image)
+    atlas.free_atlas_slot(image)
+    tiles.free_image_tiles(image)
+    texture_budget.forget(image)
+    image.reload()
+    if size is not None:
+        lod.set_image_size(image, size)
+
+
+def sync_tree(ntree, index):
+    added, changed, removed = index.diff()
+    if not (added or changed or removed):
+        return
+    cards = get_cards_by_path(ntree)
+
+    new = []
+    for path in added:
+        nodes = cards.get(path)
+        if nodes is None:
+            new.append(path)
+            continue
+        # Back after being deleted, or already on the board when watching started
+        for node in nodes:
+            if node.missing:
+                node.missing = False
+                loader.retry_card(node)
+    if new:
+        load_images(ntree, new, background=True)
+
+    reloaded = set()
+    for path in changed:
+        size = probe_size(path)
+        for node in cards.get(path, ()):
+            node.missing = False
+            loader.retry_card(node)
+            if size is not None:
+                node.image_size = size
+            image = node.image
+            if image is not None and image.as_pointer() not in reloaded:
+                reloaded.add(image.as_pointer())
+                reload_image(image, size)
+
+    for path in removed:
+        for node in cards.get(path, ()):
+            node.missing = True
+    tag_node_editors_redraw()
+
+
+def tick():
+    watched = set()
+    for ntree in bpy.data.node_groups:
+        if ntree.bl_idname != 'BlendRefTreeType' or not ntree.watch_enabled or not ntree.watch_folder:
+            continue
+        directory = os.path.normpath(bpy.path.abspath(ntree.watch_folder))
+        index = _indexes.get(ntree.name)
+        if index is None or index.directory != directory:
+            index = _indexes[ntree.name] = FolderIndex(directory)
+        watched.add(ntree.name)
+        sync_tree(ntree, index)
+    for name in list(_indexes):
+        if name not in watched:
+            del _indexes[name]
+    return WATCH_INTERVAL
+
+
+class WatchFolderPanel(bpy.types.Panel):
+    """Keep a folder of images in sync with the board"""
+    bl_idname = "BLENDREF_PT_watch_folder"
+    bl_label = "Watch Folder"
+    bl_space_type = 'NODE_EDITOR'
+    bl_region_type = 'UI'
+    bl_category = 'BlendRef'
+
+    @classmethod
+    def poll(cls, context):
+        return context.space_data.tree_type == 'BlendRefTreeType' and context.space_data.edit_tree is not None
+
+    def draw_header(self, context):
+        self.layout.prop(context.space_data.edit_tree, 'watch_enabled', text='')
+
+    def draw(self, context):
+        ntree = context.space_data.edit_tree
+        self.layout.prop(ntree, 'watch_folder', text='')
+        index = _indexes.get(ntree.name)
+        if ntree.watch_enabled and index is not None:
+            self.layout.label(text="%d images, %d arriving" % (len(index.entries), len(index.pending)))
+
+
+def register():
+    bpy.app.timers.register(tick, first_interval=WATCH_INTERVAL, persistent=True)
+
+
+def unregister():
+    if bpy.app.timers.is_registered(tick):
+        bpy.app.timers.unregister(tick)
+    _indexes.clear()
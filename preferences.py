@@ -0,0 +1,77 @@
+import bpy
+from bpy.props import IntProperty, BoolProperty
+from .utils import texture_budget
+
+
+def get_preferences():
+    return bpy.context.preferences.addons[__package__].preferences
+
+
+def update_board_composite(self, context):
+    # Give the offscreen textures back as soon as the option is turned off
+    from .utils.composite import free_composites
+    free_composites()
+
+
+class BlendRefPreferences(bpy.types.AddonPreferences):
+    bl_idname = __package__
+
+    texture_budget: IntProperty(
+        name='Texture Budget (MB)',
+        description='GPU memory card images may keep resident before the least recently seen are freed',
+        default=1024,
+        min=64,
+    )
+    eviction_frames: IntProperty(
+        name='Evict After (Frames)',
+        description='Free the textures of cards that have not been drawn for this many redraws',
+        default=600,
+        min=1,
+    )
+
+    proxy_cache_size: IntProperty(
+        name='Proxy Cache Size (MB)',
+        description='Disk space for downscaled copies of card images, the least recently used are deleted first',
+        default=2048,
+        min=16,
+    )
+
+    tile_cache_size: IntProperty(
+        name='Tile Cache Size (MB)',
+        description='Disk space for the tiles of very large images, the least recently used images are deleted first',
+        default=8192,
+        min=256,
+    )
+
+    redraw_rate: IntProperty(
+        name='Redraw Rate (Hz)',
+        description='Redraws per second while dragging cards, match it to the refresh rate of the display',
+        default=60,
+        min=1,
+        max=480,
+    )
+
+    use_board_composite: BoolProperty(
+        name='Cache Board While Navigating',
+        description='Render the board once into an offscreen texture and move that while panning and zooming, '
+                    'only changed cards are drawn again. Uses one screen sized texture per editor',
+        default=False,
+        update=update_board_composite,
+    )
+
+    def draw(self, context):
+        layout = self.layout
+        column = layout.column()
+        column.prop(self, 'texture_budget')
+        column.prop(self, 'eviction_frames')
+        column.prop(self, 'proxy_cache_size')
+        column.prop(self, 'tile_cache_size')
+        column.prop(self, 'redraw_rate')
+        column.prop(self, 'use_board_composite')
+        count, used = texture_budget.get_resident_stats()
+        row = column.row()
+        row.label(text="Resident: %d textures, %.1f MB" % (count, used / 2**20))
+        row.operator('blendref.texture_report', text='Report')
+        row = column.row()
+        row.operator('blendref.profiler_toggle', text='Toggle Profiler', icon='TIME')
+        row.operator('blendref.profiler_export', text='Export Profile')
@@ -0,0 +1,95 @@
+import bpy
+from .lazy_import import numpy as np
+from .lod import LOD_LEVELS
+
+ATLAS_SIZE = 1024
+CELL_SIZE = LOD_LEVELS[0]
+ATLAS_PREFIX = ".BlendRef Atlas "
+
+
+class AtlasPage:
+    """One shared texture holding a grid of CELL_SIZE thumbnails"""
+
+    def __init__(self, index):
+        self.image = bpy.data.images.new(ATLAS_PREFIX + str(index), ATLAS_SIZE, ATLAS_SIZE, alpha=True)
+        self.pixels = np.zeros((ATLAS_SIZE, ATLAS_SIZE, 4), dtype=np.float32)
+        self.free_cells = [(x, y)
+                           for y in range(0, ATLAS_SIZE, CELL_SIZE)
+                           for x in range(0, ATLAS_SIZE, CELL_SIZE)]
+        self.dirty = False
+
+    def add(self, thumbnail):
+        height, width = thumbnail.shape[:2]
+        x, y = self.free_cells.pop(0)
+        self.pixels[y:y + height, x:x + width] = thumbnail
+        self.dirty = True
+        # Inset by half a texel so bilinear filtering never reaches the neighbours
+        return AtlasSlot(self, (x, y), ((x + 0.5) / ATLAS_SIZE, (y + 0.5) / ATLAS_SIZE,
+                                        (width - 1) / ATLAS_SIZE, (height - 1) / ATLAS_SIZE))
+
+    def flush(self):
+        if self.dirty:
+            # Setting pixels also frees the GPU texture, gl_load uploads the new page
+            self.image.pixels.foreach_set(self.pixels.ravel())
+            self.dirty = False
+
+
+class AtlasSlot:
+    __slots__ = ('page', 'cell', 'uv_rect')
+
+    def __init__(self, page, cell, uv_rect):
+        self.page = page
+        self.cell = cell
+        self.uv_rect = uv_rect
+
+
+_pages = []
+_slots = {}
+
+
+def free_atlas():
+    _pages.clear()
+    _slots.clear()
+    for image in [image for image in bpy.data.images if image.name.startswith(ATLAS_PREFIX)]:
+        bpy.data.images.remove(image)
+
+
+def read_pixels(image):
+    width, height = image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels.reshape(height, width, 4)
+
+
+def get_atlas_slot(image, thumbnail):
+    """Atlas slot of a source image, packing its thumbnail proxy on first use.
+
+    None when thumbnail is a larger proxy or the image itself, those are
+    drawn on their own even if a smaller proxy already has a cell.
+    """
+    width, height = thumbnail.size
+    if width > CELL_SIZE or height > CELL_SIZE:
+        return None
+    pointer = image.as_pointer()
+    slot = _slots.get(pointer)
+    if slot is not None:
+        return slot
+
+    page = next((page for page in _pages if page.free_cells), None)
+    if page is None:
+        page = AtlasPage(len(_pages))
+        _pages.append(page)
+    slot = _slots[pointer] = page.add(read_pixels(thumbnail))
+    return slot
+
+
+def free_atlas_slot(image):
+    """Give the cell of image back to its page, the next thumbnail may reuse it"""
+    slot = _slots.pop(image.as_pointer(), None)
+    if slot is not None:
+        slot.page.free_cells.append(slot.cell)
+
+
+def flush_atlas():
+    for page in _pages:
+        page.flush()
@@ -0,0 +1,240 @@
+import time
+from collections import OrderedDict
+import bgl, gpu
+from gpu_extras.batch import batch_for_shader
+import bpy
+from mathutils import Matrix
+from . import loader, profiler
+from .draw_utils import (DrawContext, BoardRenderer, get_shader, get_card_rect, get_card_colors, get_card_adjustments,
+                         get_visible_cards)
+
+# Board rendered beyond every side of the region, as a share of its size, so panning stays inside the composite
+MARGIN = 0.25
+MAX_SIZE = 8192
+# The composite is stretched until the zoom differs this much from the one it was rendered at
+ZOOM_STEP = 1.5
+# Seconds the zoom has to rest before the composite is rendered sharp at the new zoom
+SETTLE_DELAY = 0.2
+MAX_COMPOSITES = 4
+
+
+class CompositeFrame(DrawContext):
+    """DrawContext of the offscreen texture: the board at the zoom of the composite, pixel (0, 0) at view position origin"""
+    __slots__ = ()
+
+    def __init__(self, frame, scale, origin, rect):
+        self.region = frame.region
+        self.dpi = frame.dpi
+        self.dpi_factor = frame.dpi_factor
+        self.scale_x, self.scale_y = scale
+        self.offset_x = -origin[0] * scale[0]
+        self.offset_y = -origin[1] * scale[1]
+        # Only the cards overlapping rect are drawn
+        self.visible_rect = rect
+
+
+def get_card_state(node, ntree, dpiFactor):
+    """(rect, signature) of everything about a card that shows in the composite"""
+    rect = get_card_rect(node, dpiFactor)
+    return rect, (rect, get_card_colors(node, ntree), node.rotation, node.scale,
+                  node.translation_x, node.translation_y, node.label, node.hide, node.image,
+                  get_card_adjustments(node))
+
+
+def get_tracked_cards(ntree, context, dpiFactor):
+    # Transforms, operators and the sidebar only edit the selected and active cards
+    selected = getattr(context, "selected_nodes", None)
+    if selected is None:
+        selected = [node for node in ntree.nodes if node.select]
+    nodes = [node for node in selected if node.bl_idname == 'CardNode']
+    active = ntree.nodes.active
+    if active is not None and active.bl_idname == 'CardNode':
+        nodes.append(active)
+    return {node.as_pointer(): get_card_state(node, ntree, dpiFactor) for node in nodes}
+
+
+def contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+
+class BoardComposite:
+    """The board of one editor region rendered once into an offscreen texture.
+
+    While the view only pans, or zooms less than ZOOM_STEP, the texture is
+    drawn shifted and stretched instead of the cards, so a redraw costs one
+    quad however many cards are visible. Cards that change are re-rendered
+    into their part of the texture. Loaded images, node count, DPI or
+    leaving the covered area re-render all of it.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.offscreen = gpu.types.GPUOffScreen(width, height)
+        self.renderer = BoardRenderer()
+        self.scale = None
+        self.origin = None
+        self.dpi = None
+        self.node_count = None
+        self.generation = None
+        # Card pointer -> (rect, signature) of the selected and active cards as rendered
+        self.tracked = {}
+        self.zoom = None
+        self.zoom_time = 0
+
+    def free(self):
+        self.offscreen.free()
+
+    @property
+    def rect(self):
+        x, y = self.origin
+        return x, y, x + self.width / self.scale[0], y + self.height / self.scale[1]
+
+    def place(self, ntree, frame):
+        """Center the composite on the view at its current zoom"""
+        self.scale = (frame.scale_x, frame.scale_y)
+        xmin, ymin, xmax, ymax = frame.visible_rect
+        self.origin = (
+            (xmin + xmax) / 2 - self.width / 2 / frame.scale_x,
+            (ymin + ymax) / 2 - self.height / 2 / frame.scale_y,
+        )
+        self.dpi = frame.dpi
+        self.node_count = len(ntree.nodes)
+        self.generation = loader.redraw_generation
+
+    def needs_full_render(self, ntree, frame, now):
+        if self.scale is None or frame.dpi != self.dpi or len(ntree.nodes) != self.node_count:
+            return True
+        if loader.redraw_generation != self.generation:
+            return True
+        ratio = frame.scale_x / self.scale[0]
+        if ratio != 1:
+            if not 1 / ZOOM_STEP <= ratio <= ZOOM_STEP or now - self.zoom_time >= SETTLE_DELAY:
+                return True
+            if not bpy.app.timers.is_registered(loader.tag_node_editors_redraw):
+                # Comes back sharp once the zoom rests
+                bpy.app.timers.register(loader.tag_node_editors_redraw, first_interval=SETTLE_DELAY)
+        return not contains(self.rect, frame.visible_rect)
+
+    def get_dirty_rect(self, tracked):
+        """View rect of the cards that changed since they were rendered, old and new place, or None"""
+        boxes = []
+        for pointer in self.tracked.keys() | tracked.keys():
+            old = self.tracked.get(pointer)
+            new = tracked.get(pointer)
+            if old is not None and new is not None and old[1] == new[1]:
+                continue
+            boxes.extend(state[0] for state in (old, new) if state is not None)
+        if not boxes:
+            return None
+        # Borders are drawn 2 pixels wide around the card
+        pad_x, pad_y = 2 / self.scale[0], 2 / self.scale[1]
+        return (min(x for x, y, w, h in boxes) - pad_x, min(y - h for x, y, w, h in boxes) - pad_y,
+                max(x + w for x, y, w, h in boxes) + pad_x, max(y for x, y, w, h in boxes) + pad_y)
+
+    def render(self, ntree, context, frame, rect=None):
+        """Render the cards overlapping rect, the whole composite by default"""
+        cover = self.rect
+        target = CompositeFrame(frame, self.scale, self.origin, rect or cover)
+        with profiler.Stage('nodes'):
+            nodes = get_visible_cards(ntree, context, target)
+        with self.offscreen.bind(), gpu.matrix.push_pop(), gpu.matrix.push_pop_projection():
+            gpu.matrix.load_identity()
+            gpu.matrix.load_projection_matrix(Matrix.Identity(4))
+            gpu.matrix.translate((-1, -1))
+            gpu.matrix.scale((2 / self.width, 2 / self.height))
+            if rect is not None:
+                x0 = max(int((rect[0] - cover[0]) * self.scale[0]), 0)
+                y0 = max(int((rect[1] - cover[1]) * self.scale[1]), 0)
+                x1 = min(int((rect[2] - cover[0]) * self.scale[0]) + 1, self.width)
+                y1 = min(int((rect[3] - cover[1]) * self.scale[1]) + 1, self.height)
+                bgl.glEnable(bgl.GL_SCISSOR_TEST)
+                bgl.glScissor(x0, y0, max(x1 - x0, 0), max(y1 - y0, 0))
+            bgl.glClearColor(0, 0, 0, 0)
+            bgl.glClear(bgl.GL_COLOR_BUFFER_BIT)
+            self.renderer.draw(ntree, nodes, target, partial=rect is not None)
+            if rect is not None:
+                bgl.glDisable(bgl.GL_SCISSOR_TEST)
+
+    def blit(self, frame):
+        x0 = self.origin[0] * frame.scale_x + frame.offset_x
+        y0 = self.origin[1] * frame.scale_y + frame.offset_y
+        x1 = x0 + self.width * frame.scale_x / self.scale[0]
+        y1 = y0 + self.height * frame.scale_y / self.scale[1]
+        shader = get_shader('blit')
+        batch = batch_for_shader(shader, 'TRI_FAN', {
+            "pos": ((x0, y0), (x1, y0), (x1, y1), (x0, y1)),
+            "texCoord": ((0, 0), (1, 0), (1, 1), (0, 1)),
+        })
+        bgl.glActiveTexture(bgl.GL_TEXTURE0)
+        bgl.glBindTexture(bgl.GL_TEXTURE_2D, self.offscreen.color_texture)
+        # The texture is clear where there are no cards
+        bgl.glEnable(bgl.GL_BLEND)
+        bgl.glBlendFunc(bgl.GL_ONE, bgl.GL_ONE_MINUS_SRC_ALPHA)
+        shader.bind()
+        shader.uniform_int("image", 0)
+        batch.draw(shader)
+        bgl.glDisable(bgl.GL_BLEND)
+
+    def draw(self, ntree, context, frame):
+        now = time.perf_counter()
+        if frame.scale_x != self.zoom:
+            self.zoom = frame.scale_x
+            self.zoom_time = now
+        tracked = get_tracked_cards(ntree, context, frame.dpi_factor)
+        if self.needs_full_render(ntree, frame, now):
+            self.place(ntree, frame)
+            self.render(ntree, context, frame)
+        else:
+            dirty = self.get_dirty_rect(tracked)
+            if dirty is not None:
+                self.render(ntree, context, frame, dirty)
+        self.tracked = tracked
+        with profiler.Stage('draw'):
+            self.blit(frame)
+
+
+# (node tree pointer, region pointer) -> BoardComposite, least recently drawn first
+_composites = OrderedDict()
+# Set when the GPU could not create an offscreen, the cards are then drawn directly
+_unsupported = False
+
+
+def free_composites():
+    for composite in _composites.values():
+        composite.free()
+    _composites.clear()
+
+
+def get_composite(ntree, region):
+    global _unsupported
+    key = (ntree.as_pointer(), region.as_pointer())
+    width = min(int(region.width * (1 + 2 * MARGIN)), max(region.width, MAX_SIZE))
+    height = min(int(region.height * (1 + 2 * MARGIN)), max(region.height, MAX_SIZE))
+    composite = _composites.get(key)
+    if composite is not None and (composite.width, composite.height) != (width, height):
+        _composites.pop(key).free()
+        composite = None
+    if composite is None:
+        try:
+            composite = BoardComposite(width, height)
+        except Exception as e:
+            print('Could not create the board composite', e)
+            _unsupported = True
+            return None
+        _composites[key] = composite
+        while len(_composites) > MAX_COMPOSITES:
+            _composites.popitem(last=False)[1].free()
+    _composites.move_to_end(key)
+    return composite
+
+
+def draw_composite(ntree, context, frame):
+    """Draw the board through its cached composite, False when there is none and the cards have to be drawn directly"""
+    if _unsupported:
+        return False
+    composite = get_composite(ntree, frame.region)
+    if composite is None:
+        return False
+    composite.draw(ntree, context, frame)
+    return True
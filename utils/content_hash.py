@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+from .paths import get_cache_dir
+from .probe import probe_size
+
+CHUNK_SIZE = 1 << 20
+
+
+class FileInfo:
+    """What the import needs to know about a file before decoding it"""
+    __slots__ = ('path', 'size', 'digest', 'file_size', 'mtime')
+
+    def __init__(self, path, size=None, digest=None, file_size=0, mtime=0):
+        self.path = path
+        self.size = size
+        self.digest = digest
+        self.file_size = file_size
+        self.mtime = mtime
+
+
+def hash_file(path):
+    # hashlib releases the GIL on large updates, so workers hash in parallel
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def inspect_file(path, known=None):
+    """Probe size and content hash of path, reusing the known (size, mtime, digest) entry if the file is unchanged"""
+    try:
+        stat = os.stat(path)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            digest = known[2]
+        else:
+            digest = hash_file(path)
+    except OSError:
+        return FileInfo(path, probe_size(path))
+    return FileInfo(path, probe_size(path), digest, stat.st_size, stat.st_mtime_ns)
+
+
+class HashIndex:
+    """Content hashes of files, persisted by path and invalidated by size and mtime"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, path):
+        with self.lock:
+            return self.entries.get(path)
+
+    def store(self, info):
+        if info.digest is None:
+            return
+        with self.lock:
+            self.entries[info.path] = [info.file_size, info.mtime, info.digest]
+            self.dirty = True
+
+    def lookup(self, path):
+        """Digest of path if it is indexed and unchanged on disk"""
+        entry = self.get(path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def save(self):
+        if not self.dirty:
+            return
+        with self.lock:
+            data = json.dumps(self.entries)
+            self.dirty = False
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(data)
+        os.replace(temp, self.path)
+
+
+_hash_index = None
+
+
+def get_hash_index():
+    global _hash_index
+    if _hash_index is None:
+        _hash_index = HashIndex(os.path.join(get_cache_dir(), 'hash_index.json'))
+    return _hash_index
@@ -0,0 +1,98 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .lazy_import import numpy as np
+from . import proxy_cache
+from .probe import probe_size
+
+_pillow = False
+
+
+def get_pillow():
+    """PIL.Image, imported on first use, or None.
+
+    Pillow is optional, without it workers only read cached proxies and
+    prefetch files, Blender decodes them on the main thread.
+    """
+    global _pillow
+    if _pillow is False:
+        try:
+            from PIL import Image
+            # Scans and stitched panoramas are legitimately huge, not decompression bombs
+            Image.MAX_IMAGE_PIXELS = None
+        except ImportError:
+            Image = None
+        _pillow = Image
+    return _pillow
+
+
+class DecodeResult:
+    """Outcome of decoding one file off the main thread.
+
+    size is the full resolution (width, height) and thumbnail a bottom-up RGBA
+    float32 array ready for Image.pixels, either may be None when unknown.
+    """
+    __slots__ = ('path', 'size', 'thumbnail', 'error')
+
+    def __init__(self, path, size=None, thumbnail=None, error=None):
+        self.path = path
+        self.size = size
+        self.thumbnail = thumbnail
+        self.error = error
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='BlendRefDecode')
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def prefetch(path):
+    # Pull the file into the OS cache so the main thread decode does not wait on disk
+    with open(path, 'rb') as f:
+        while f.read(1 << 20):
+            pass
+
+
+def decode(path, max_size):
+    """Decode path into a thumbnail whose longest side is at most max_size. Never raises."""
+    try:
+        cached = proxy_cache.load(path, max_size)
+        if cached is not None:
+            return DecodeResult(path, probe_size(path), cached)
+        Image = get_pillow()
+        if Image is None:
+            prefetch(path)
+            return DecodeResult(path)
+        with Image.open(path) as image:
+            size = image.size
+            # Lets the JPEG decoder skip straight to a reduced scale
+            image.draft('RGB', (max_size, max_size))
+            image = image.convert('RGBA')
+            image.thumbnail((max_size, max_size))
+            pixels = np.ascontiguousarray(np.asarray(image, dtype=np.float32)[::-1] / 255)
+        proxy_cache.store(path, max_size, pixels)
+        return DecodeResult(path, size, pixels)
+    except Exception as e:
+        return DecodeResult(path, error=e)
+
+
+def submit(paths, max_size, callback):
+    """Decode paths on the worker pool, callback receives each DecodeResult from a worker thread"""
+    executor = get_executor()
+    futures = []
+    for path in paths:
+        future = executor.submit(decode, path, max_size)
+        future.add_done_callback(lambda future: callback(future.result()))
+        futures.append(future)
+    return futures
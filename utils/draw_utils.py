@@ -3,46 +3,62 @@ from gpu_extras.batch import batch_for_shader
 import blf
 import bpy
 import textwrap
+import time
+from .lazy_import import numpy as np
+from .spatial_index import GridIndex
+from . import lod, atlas, texture_budget, loader, proxy_cache, profiler, text_metrics, tiles
+from ..preferences import get_preferences
 
-from mathutils import Vector, Matrix
 from math import cos, sin, radians
-shader = gpu.shader.from_builtin('3D_UNIFORM_COLOR')
+
+# Card adjustments, applied to the texels as they are sampled so the image
+# itself is never touched. adjust is (brightness, contrast, posterize levels,
+# channel) with channel 0 for RGB and 1 to 4 for R, G, B and A alone, toggles
+# is (grayscale, flip x, flip y)
+adjustments = '''
+vec2 flip_coord(vec2 tc, vec3 toggles) {
+    return mix(tc, vec2(1.0) - tc, toggles.yz);
+}
+
+vec4 adjust_color(vec4 color, vec4 adjust, vec3 toggles) {
+    int channel = int(adjust.w);
+    if (channel > 0)
+        color = vec4(vec3(color[channel - 1]), 1.0);
+    if (toggles.x > 0.5)
+        color.rgb = vec3(dot(color.rgb, vec3(0.2126, 0.7152, 0.0722)));
+    color.rgb = clamp((color.rgb - 0.5) * (1.0 + adjust.y) + 0.5 + adjust.x, 0.0, 1.0);
+    if (adjust.z > 1.0)
+        color.rgb = min(floor(color.rgb * adjust.z), adjust.z - 1.0) / (adjust.z - 1.0);
+    return color;
+}
+'''
 
 frag = '''
 in vec2 texCoord_interp;
 out vec4 fragColor;
 
 uniform sampler2D image;
-
+uniform vec4 adjust;
+uniform vec3 toggles;
+''' + adjustments + '''
 
 void main()
 {
     if(texCoord_interp.x > 1 || texCoord_interp.y > 1 || texCoord_interp.x < 0 || texCoord_interp.y < 0 )
         fragColor = vec4(0.188);
     else
-        fragColor = texture(image, texCoord_interp);
+        fragColor = adjust_color(texture(image, flip_coord(texCoord_interp, toggles)), adjust, toggles);
 }
 '''
 
-vert = '''
-    
-uniform mat4 ModelViewProjectionMatrix;
-
-in vec2 texCoord;
-in vec2 pos;
-out vec2 texCoord_interp;
-uniform float rotation;
-uniform vec2 location;
-uniform float scale;
-uniform vec2 u_resolution;
-
+mapping = '''
 vec2 HALF = vec2(0.5);
 
-vec2 rotate(float angle, vec2 tc) {
+vec2 rotate(float angle, vec2 tc, vec2 resolution) {
     float aSin = sin(angle);
     float aCos = cos(angle);
 
-    float aspect = u_resolution.x / u_resolution.y;
+    float aspect = resolution.x / resolution.y;
 
     mat2 rotMat      = mat2(aCos, -aSin, aSin, aCos);
     mat2 scaleMat    = mat2(aspect, 0.0, 0.0, 1.0);
@@ -54,21 +70,129 @@ vec2 rotate(float angle, vec2 tc) {
     return tc;
 }
 
-vec3 node_mapping(vec3 VectorIn, vec3 Location, vec3 Rotation, vec3 Scale) {
+vec3 node_mapping(vec3 VectorIn, vec3 Location, vec3 Rotation, vec3 Scale, vec2 resolution) {
     vec3 tc = ((VectorIn - vec3(0.5)) * Scale) + Location + vec3(0.5);
-    return vec3(rotate(Rotation.z, tc.xy), 0);
+    return vec3(rotate(Rotation.z, tc.xy, resolution), 0);
 }
+'''
 
+vert = '''
+    
+uniform mat4 ModelViewProjectionMatrix;
+
+in vec2 texCoord;
+in vec2 pos;
+out vec2 texCoord_interp;
+uniform float rotation;
+uniform vec2 location;
+uniform float scale;
+uniform vec2 u_resolution;
+''' + mapping + '''
 
 void main()
 {
   gl_Position = ModelViewProjectionMatrix * vec4(pos.xy, 0.0f, 1.0f);
   gl_Position.z = 1.0;
-  texCoord_interp = node_mapping(vec3(texCoord, 0), vec3(location, 0), vec3(0, 0, rotation), vec3(1/scale)).xy;
+  texCoord_interp = node_mapping(vec3(texCoord, 0), vec3(location, 0), vec3(0, 0, rotation), vec3(1/scale), u_resolution).xy;
 }
 '''
 
-image_shader = gpu.types.GPUShader(vert, frag)
+# Atlas variant: the per card mapping comes in as vertex attributes so a whole
+# atlas page draws in one call, uvRect selects the card's cell in the page
+atlas_frag = '''
+in vec2 texCoord_interp;
+flat in vec4 uvRect_interp;
+flat in vec4 adjust_interp;
+flat in vec3 toggles_interp;
+out vec4 fragColor;
+
+uniform sampler2D image;
+''' + adjustments + '''
+
+void main()
+{
+    if(texCoord_interp.x > 1 || texCoord_interp.y > 1 || texCoord_interp.x < 0 || texCoord_interp.y < 0 )
+        fragColor = vec4(0.188);
+    else {
+        vec2 tc = flip_coord(texCoord_interp, toggles_interp);
+        fragColor = adjust_color(texture(image, uvRect_interp.xy + tc * uvRect_interp.zw), adjust_interp, toggles_interp);
+    }
+}
+'''
+
+atlas_vert = '''
+uniform mat4 ModelViewProjectionMatrix;
+
+in vec2 texCoord;
+in vec2 pos;
+in float rotation;
+in vec2 location;
+in float scale;
+in vec2 resolution;
+in vec4 uvRect;
+in vec4 adjust;
+in vec3 toggles;
+out vec2 texCoord_interp;
+flat out vec4 uvRect_interp;
+flat out vec4 adjust_interp;
+flat out vec3 toggles_interp;
+''' + mapping + '''
+
+void main()
+{
+  gl_Position = ModelViewProjectionMatrix * vec4(pos.xy, 0.0f, 1.0f);
+  gl_Position.z = 1.0;
+  texCoord_interp = node_mapping(vec3(texCoord, 0), vec3(location, 0), vec3(0, 0, rotation), vec3(1/scale), resolution).xy;
+  uvRect_interp = uvRect;
+  adjust_interp = adjust;
+  toggles_interp = toggles;
+}
+'''
+
+# Tile variant: the texture holds the part tileRect of the image, the rest of
+# the card is left to the proxy drawn below
+tile_frag = '''
+in vec2 texCoord_interp;
+out vec4 fragColor;
+
+uniform sampler2D image;
+uniform vec4 tileRect;
+uniform vec4 adjust;
+uniform vec3 toggles;
+''' + adjustments + '''
+
+void main()
+{
+    // Flips mirror the whole image, then the tile picks its part of it
+    vec2 uv = (flip_coord(texCoord_interp, toggles) - tileRect.xy) / tileRect.zw;
+    if(uv.x > 1 || uv.y > 1 || uv.x < 0 || uv.y < 0 )
+        discard;
+    fragColor = adjust_color(texture(image, uv), adjust, toggles);
+}
+'''
+
+SHADER_SOURCES = {
+    'image': (vert, frag),
+    'atlas': (atlas_vert, atlas_frag),
+    'tile': (vert, tile_frag),
+}
+BUILTIN_SHADERS = {
+    'color': '2D_SMOOTH_COLOR',
+    'blit': '2D_IMAGE',
+}
+_shaders = {}
+
+
+def get_shader(name):
+    """Shader by name, compiled on first draw so enabling the add-on compiles nothing"""
+    shader = _shaders.get(name)
+    if shader is None:
+        if name in BUILTIN_SHADERS:
+            shader = gpu.shader.from_builtin(BUILTIN_SHADERS[name])
+        else:
+            shader = gpu.types.GPUShader(*SHADER_SOURCES[name])
+        _shaders[name] = shader
+    return shader
 
 def get_dpi_factor():
     return get_dpi() / 72
@@ -78,117 +202,499 @@ def get_dpi():
     retinaFactor = getattr(systemPreferences, "pixel_size", 1)
     return systemPreferences.dpi * retinaFactor
 
-def get_position(node, region, dpiFactor, offset):
-    location = node.location * dpiFactor
+class CardBatches:
+    """Cached view-space geometry of a card, so panning never rebuilds it"""
+    __slots__ = ('key', 'background', 'border', 'image')
+
+    def __init__(self, key, background, border, image):
+        self.key = key
+        self.background = background
+        self.border = border
+        self.image = image
+
+
+_card_batches = {}
+
+
+def free_card_batches(node=None):
+    if node is None:
+        _card_batches.clear()
+    else:
+        _card_batches.pop(node.as_pointer(), None)
+
+
+def get_view_transform(region):
+    # view2d.view_to_region is affine, two samples are enough to recover it
     viewToRegion = region.view2d.view_to_region
-    return Vector(viewToRegion(location.x + offset.x, location.y + offset.y, clip = False))
+    x0, y0 = viewToRegion(0, 0, clip=False)
+    x1, y1 = viewToRegion(1000, 1000, clip=False)
+    return (x1 - x0) / 1000, (y1 - y0) / 1000, x0, y0
+
+
+class DrawContext:
+    """The view transform, visible rectangle and DPI of a region, read once per frame.
+
+    Everything per card is then derived from these with NumPy instead of a
+    view2d call per corner.
+    """
+    __slots__ = ('region', 'dpi', 'dpi_factor', 'scale_x', 'scale_y', 'offset_x', 'offset_y', 'visible_rect')
+
+    def __init__(self, region):
+        self.region = region
+        self.dpi = get_dpi()
+        self.dpi_factor = self.dpi / 72
+        self.scale_x, self.scale_y, self.offset_x, self.offset_y = get_view_transform(region)
+        # Inverting the transform replaces two region_to_view calls
+        self.visible_rect = (
+            -self.offset_x / self.scale_x, -self.offset_y / self.scale_y,
+            (region.width - self.offset_x) / self.scale_x, (region.height - self.offset_y) / self.scale_y,
+        )
+
+    @property
+    def transform(self):
+        return self.scale_x, self.scale_y, self.offset_x, self.offset_y
+
+    @property
+    def center(self):
+        xmin, ymin, xmax, ymax = self.visible_rect
+        return (xmin + xmax) / 2, (ymin + ymax) / 2
+
+    def cull(self, rects):
+        """Mask of the (x, y, w, h) view-space rects, y at the top, that overlap the region"""
+        xmin, ymin, xmax, ymax = self.visible_rect
+        x, y, w, h = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+        return (x <= xmax) & (x + w >= xmin) & (y >= ymin) & (y - h <= ymax)
+
 
-def getNodeTopCornerLocations(node, region, dpiFactor):
+def get_card_rects(cards):
+    """(x, y, w, h, hide) of every card as one array"""
+    return np.array([batches.key for batches in cards], dtype=np.float64).reshape(-1, 5)
+
+
+def get_card_rect(node, dpiFactor):
     location = node.location * dpiFactor
     if node.hide:
         location.y += 5 * dpiFactor
     dimensions = node.dimensions
-    x = location.x
-    y = location.y
-
-    viewToRegion = region.view2d.view_to_region
-    topLeft = Vector(viewToRegion(x, y, clip = False))
-    topRight = Vector(viewToRegion(x + dimensions.x, y, clip = False))
-    
-    y = location.y - dimensions.y
-    bottomLeft = Vector(viewToRegion(x, y, clip = False))
-    bottomRight = Vector(viewToRegion(x + dimensions.x, y, clip = False))
-    
-    return topLeft, topRight, bottomLeft, bottomRight
+    return location.x, location.y, dimensions.x, dimensions.y
 
 
-def getDrawPositionAndWidth(node, region, dpiFactor):
-    topLeft, topRight, bottomLeft, bottomRight = getNodeTopCornerLocations(node, region, dpiFactor)
-    width = topRight.x - topLeft.x
-    height = topLeft.y - bottomLeft.y
-    return topLeft, width, height
+def get_card_batches(node, dpiFactor):
+    x, y, w, h = get_card_rect(node, dpiFactor)
+    key = (x, y, w, h, node.hide)
+    pointer = node.as_pointer()
+    batches = _card_batches.get(pointer)
+    if batches is not None and batches.key == key:
+        return batches
 
+    background = ((x, y), (x + w, y), (x, y - h), (x, y - h), (x + w, y), (x + w, y - h))
+    border = ((x, y), (x + w, y), (x + w, y), (x + w, y - h),
+              (x + w, y - h), (x, y - h), (x, y - h), (x, y))
 
-def draw_image(node, ntree, coords):  
-    coords = [(x, y) for x, y, z in coords[:-1]]
+    coords = ((x, y), (x + w, y), (x + w, y - h), (x, y - h))
     texCoord = ((0, 1), (1, 1), (1, 0), (0, 0))
-    image = node.image
-
-    shader = image_shader
-    batch = batch_for_shader(
-        shader, 'TRI_FAN',
+    profiler.count('batches')
+    image = batch_for_shader(
+        get_shader('image'), 'TRI_FAN',
         {
             "pos": coords,
             "texCoord": texCoord,
         },
     )
-    if image.gl_load():
-        raise Exception()
-    
-    bgl.glActiveTexture(bgl.GL_TEXTURE0)
-    bgl.glBindTexture(bgl.GL_TEXTURE_2D, image.bindcode)
+    batches = CardBatches(key, background, border, image)
+    _card_batches[pointer] = batches
+    return batches
 
-    shader.bind()
-    shader.uniform_int("image", 0)
-    shader.uniform_float("rotation", radians(node.rotation))
-    shader.uniform_float("location", (node.translation_x, node.translation_y))
-    shader.uniform_float("scale", node.scale)
-    shader.uniform_float("u_resolution", node.image.size)
-    batch.draw(shader)
 
+def get_card_image_size(node):
+    # Stored on the card so sizing it never has to decode the image
+    return tuple(node.image_size) if node.image_size[0] > 0 else None
 
-def draw_card(node, ntree):
-    dpiFactor = get_dpi_factor()
-    position, w, h = getDrawPositionAndWidth(node, bpy.context.region, dpiFactor)
-    x, y = position
-    coords = [(x, y, 0), (x + w, y, 0), (x, y - h, 0), (x + w, y - h, 0)]
+
+CHANNELS = ('RGB', 'R', 'G', 'B', 'A')
+
+
+def get_card_adjustments(node):
+    """(adjust, toggles) shader inputs of the adjustments of a card"""
+    adjust = (node.brightness, node.contrast, float(node.posterize), float(CHANNELS.index(node.channel)))
+    toggles = (float(node.grayscale), float(node.flip_x), float(node.flip_y))
+    return adjust, toggles
+
+
+def get_card_colors(node, ntree):
     if node.use_custom_color:
         r, g, b = node.color * 0.9
     else:
         r, g, b = (0.188, 0.188, 0.188)
-    
-    indices = ((0, 1, 2), (2, 1, 3))
-    batch = batch_for_shader(shader, 'TRIS', {"pos": coords}, indices=indices)
-    # bgl.glEnable(bgl.GL_BLEND)
-    shader.bind()
-    shader.uniform_float("color", (r, g, b, 1))
-    batch.draw(shader)
-    
+
     if node.select:
         if ntree.nodes.active == node:
             color = (1, 1, 1, 1)
         else:
             color = (0.8, 0, 0, 1)
+    elif node.missing:
+        color = (1, 0.5, 0, 1)
     else:
         color = (0.5, 0.5, 0.5, 1)
-        
-    coords = [(x, y, 0), (x + w, y, 0), (x + w, y - h, 0), (x, y - h, 0), (x, y, 0)]    
-    batch = batch_for_shader(shader, 'LINE_STRIP', {"pos": coords})
-    bgl.glLineWidth(2)
+    return (r, g, b, 1), color
+
+
+class BoardRenderer:
+    """Draws every visible card of a board with one background and one border draw call.
+
+    The packed vertex buffers are only rebuilt when the visible cards, their
+    geometry or their colors change.
+    """
+
+    def __init__(self):
+        self.background_signature = None
+        self.background = None
+        self.border_signature = None
+        self.border = None
+        self.atlas_batches = {}
+
+    def build_backgrounds(self, cards, colors):
+        signature = tuple((batches.key, background) for batches, (background, border) in zip(cards, colors))
+        if signature == self.background_signature:
+            return
+        pos = []
+        color = []
+        for batches, (background, border) in zip(cards, colors):
+            pos.extend(batches.background)
+            color.extend((background,) * 6)
+        profiler.count('batches')
+        self.background = batch_for_shader(get_shader('color'), 'TRIS', {"pos": pos, "color": color})
+        self.background_signature = signature
+
+    def build_borders(self, cards, colors):
+        signature = tuple((batches.key, border) for batches, (background, border) in zip(cards, colors))
+        if signature == self.border_signature:
+            return
+        pos = []
+        color = []
+        for batches, (background, border) in zip(cards, colors):
+            pos.extend(batches.border)
+            color.extend((border,) * 8)
+        profiler.count('batches')
+        self.border = batch_for_shader(get_shader('color'), 'LINES', {"pos": pos, "color": color})
+        self.border_signature = signature
+
+    def build_atlas_batch(self, page, entries):
+        signature = tuple((batches.key, node.rotation, node.scale, node.translation_x, node.translation_y,
+                           slot.uv_rect, size, get_card_adjustments(node)) for node, batches, slot, size in entries)
+        cached = self.atlas_batches.get(page)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        pos, texCoord, rotation, location, scale, resolution, uvRect = [], [], [], [], [], [], []
+        adjust, toggles = [], []
+        for (node, batches, slot, size), card in zip(entries, signature):
+            card_adjust, card_toggles = card[-1]
+            x, y, w, h, hide = batches.key
+            pos.extend(((x, y), (x + w, y), (x, y - h), (x, y - h), (x + w, y), (x + w, y - h)))
+            texCoord.extend(((0, 1), (1, 1), (0, 0), (0, 0), (1, 1), (1, 0)))
+            rotation.extend((radians(node.rotation),) * 6)
+            location.extend(((node.translation_x, node.translation_y),) * 6)
+            scale.extend((node.scale,) * 6)
+            resolution.extend((size,) * 6)
+            uvRect.extend((slot.uv_rect,) * 6)
+            adjust.extend((card_adjust,) * 6)
+            toggles.extend((card_toggles,) * 6)
+        profiler.count('batches')
+        batch = batch_for_shader(get_shader('atlas'), 'TRIS', {
+            "pos": pos,
+            "texCoord": texCoord,
+            "rotation": rotation,
+            "location": location,
+            "scale": scale,
+            "resolution": resolution,
+            "uvRect": uvRect,
+            "adjust": adjust,
+            "toggles": toggles,
+        })
+        self.atlas_batches[page] = (signature, batch)
+        return batch
+
+    def draw_images(self, ntree, nodes, cards, rects, frame):
+        pages = {}
+        center_x, center_y = frame.center
+        x, y, w, h = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+        # Cards closest to the middle of the view load first
+        priorities = (np.abs(x + w / 2 - center_x) + np.abs(y - h / 2 - center_y)).tolist()
+        widths = (w * frame.scale_x).tolist()
+        for node, batches, priority, width, rect in zip(nodes, cards, priorities, widths, rects[:, :4].tolist()):
+            if node.hide:
+                continue
+            if not node.image:
+                if node.filepath:
+                    loader.request_card(node, priority)
+                continue
+            # Pick the smallest proxy with enough texels for the visible part of the image
+            size = get_card_image_size(node)
+            image, missing = lod.get_lod_image(node.image, width * max(node.scale, 1), size)
+            if image is node.image and missing is None and tiles.use_tiles(image, lod.get_image_size(image, size)):
+                self.draw_tiled(ntree, node, batches, rect, frame, priority)
+                continue
+            if missing is not None:
+                loader.request_proxy(ntree, node.image, missing, priority)
+            if image is None:
+                continue
+            slot = atlas.get_atlas_slot(node.image, image)
+            if slot is None:
+                draw_image(node, image, batches.image)
+            else:
+                pages.setdefault(slot.page, []).append((node, batches, slot, lod.get_image_size(node.image)))
+
+        atlas.flush_atlas()
+        for page, entries in pages.items():
+            batch = self.build_atlas_batch(page, entries)
+            bind_image(page.image)
+            atlas_shader = get_shader('atlas')
+            atlas_shader.bind()
+            atlas_shader.uniform_int("image", 0)
+            batch.draw(atlas_shader)
+        for page in list(self.atlas_batches):
+            if page not in pages:
+                del self.atlas_batches[page]
+
+    def draw_tiled(self, ntree, node, batches, rect, frame, priority):
+        # Never upload the whole image, the biggest proxy covers the tiles still loading
+        size = lod.get_image_size(node.image, get_card_image_size(node))
+        # Picked by level, not width: a tall image's largest proxy is narrower than the level
+        proxy, missing = lod.get_proxy(node.image, lod.LOD_LEVELS[-1], size)
+        if missing is not None:
+            loader.request_proxy(ntree, node.image, missing, priority)
+        if proxy is not None:
+            draw_image(node, proxy, batches.image)
+        for tile, tile_rect in tiles.get_tiles(node, node.image, size, rect, frame):
+            draw_tile(node, tile, tile_rect, batches.image, size)
+
+    def draw(self, ntree, nodes, frame, partial=False):
+        if not nodes:
+            return
+        dpiFactor = frame.dpi_factor
+        # A partial redraw doesn't ask for every visible card, a new loader
+        # generation would cancel the requests of the others as stale
+        if not partial:
+            loader.begin_frame(ntree)
+        texture_budget.begin_frame()
+        tiles.begin_frame()
+        with profiler.Stage('batch'):
+            cards = [get_card_batches(node, dpiFactor) for node in nodes]
+        with profiler.Stage('transform'):
+            rects = get_card_rects(cards)
+            # The index hands out whole grid cells, drop the cards just outside the region
+            visible = frame.cull(rects)
+            if not visible.all():
+                nodes = [node for node, keep in zip(nodes, visible.tolist()) if keep]
+                cards = [batches for batches, keep in zip(cards, visible.tolist()) if keep]
+                rects = rects[visible]
+            colors = [get_card_colors(node, ntree) for node in nodes]
+        profiler.count('cards', len(nodes))
+        if not nodes:
+            loader.end_frame()
+            return
+        with profiler.Stage('batch'):
+            self.build_backgrounds(cards, colors)
+            self.build_borders(cards, colors)
+
+        with profiler.Stage('draw'), gpu.matrix.push_pop():
+            gpu.matrix.translate((frame.offset_x, frame.offset_y))
+            gpu.matrix.scale((frame.scale_x, frame.scale_y))
+
+            color_shader = get_shader('color')
+            color_shader.bind()
+            self.background.draw(color_shader)
+
+            self.draw_images(ntree, nodes, cards, rects, frame)
+
+            bgl.glLineWidth(2)
+            color_shader.bind()
+            self.border.draw(color_shader)
+            bgl.glLineWidth(1)
+
+        with profiler.Stage('text'):
+            draw_headers(nodes, rects, frame)
+        loader.end_frame()
+
+        preferences = get_preferences()
+        texture_budget.enforce(preferences.texture_budget * 2**20, preferences.eviction_frames)
+        proxy_cache.max_bytes = preferences.proxy_cache_size * 2**20
+        tiles.max_bytes = preferences.tile_cache_size * 2**20
+
+
+def get_header_positions(rects, frame):
+    """Region-space position and available width of the header text of every card"""
+    dpiFactor = frame.dpi_factor
+    x, y, w, hide = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 4]
+    indent = np.where(hide, 22, 23) * dpiFactor
+    text_x = (x + indent) * frame.scale_x + frame.offset_x
+    text_y = (y - (15 + 5 * hide) * dpiFactor) * frame.scale_y + frame.offset_y
+    widths = (w - indent) * frame.scale_x
+    return text_x.astype(int).tolist(), text_y.astype(int).tolist(), widths.tolist()
+
+
+def draw_headers(nodes, rects, frame):
+    # Every header shares the same font size and color, set them once
+    size, dpi = int(12 * frame.scale_x), int(frame.dpi)
+    blf.size(0, size, dpi)
+    blf.color(0, 0.9, 0.9, 0.9, 1)
+    metrics = text_metrics.get_metrics(size, dpi)
+    for node, x, y, width in zip(nodes, *get_header_positions(rects, frame)):
+        text = "Select Source" if not node.label else node.label
+        text = text_metrics.get_header_text(node, text, width, metrics)
+        blf.position(0, x, y, 0)
+        blf.draw(0, text)
+
+
+_board_renderers = {}
+
+
+def free_board_renderers():
+    _board_renderers.clear()
+
+
+def draw_board(ntree, nodes, frame):
+    renderer = _board_renderers.get(ntree.as_pointer())
+    if renderer is None:
+        renderer = _board_renderers[ntree.as_pointer()] = BoardRenderer()
+    renderer.draw(ntree, nodes, frame)
+
+
+class BoardIndex:
+    """Spatial index of the cards of one node tree"""
+
+    def __init__(self, ntree, dpiFactor):
+        self.dpi_factor = dpiFactor
+        self.grid = GridIndex()
+        self.node_count = len(ntree.nodes)
+        for node in ntree.nodes:
+            if node.type != 'FRAME':
+                self.grid.insert(node.as_pointer(), node, get_card_rect(node, dpiFactor))
+
+    def update(self, node):
+        return self.grid.update(node.as_pointer(), node, get_card_rect(node, self.dpi_factor))
+
+    def remove(self, node):
+        self.grid.remove(node.as_pointer())
+
+
+_board_indices = {}
+
+
+def free_board_indices():
+    _board_indices.clear()
+
+
+def get_board_index(ntree, dpiFactor):
+    pointer = ntree.as_pointer()
+    index = _board_indices.get(pointer)
+    if index is None or index.dpi_factor != dpiFactor or index.node_count != len(ntree.nodes):
+        index = BoardIndex(ntree, dpiFactor)
+        _board_indices[pointer] = index
+    return index
+
+
+def update_card_index(node):
+    index = _board_indices.get(node.id_data.as_pointer())
+    if index is not None:
+        index.update(node)
+
+
+def remove_card_index(node):
+    index = _board_indices.get(node.id_data.as_pointer())
+    if index is not None:
+        index.remove(node)
+        index.node_count -= 1
+
+
+def get_visible_cards(ntree, context, frame):
+    index = get_board_index(ntree, frame.dpi_factor)
+
+    # Cards only move through transforms of the selection or through our own
+    # operators (which call update_card_index), so the selection is all that
+    # has to be resynced before querying
+    selected = getattr(context, "selected_nodes", None)
+    if selected is None:
+        selected = (node for node in ntree.nodes if node.select)
+    for node in selected:
+        if node.type != 'FRAME':
+            index.update(node)
+
+    visible = [node for _, node in index.grid.query(*frame.visible_rect)]
+    # Dimensions are recomputed by the node editor itself (e.g. after an image
+    # change), keep the cards we are about to draw up to date
+    for node in visible:
+        index.update(node)
+    return visible
+
+
+def bind_image(image):
+    # gl_load is a no-op for resident textures, only real uploads are timed
+    if not image.bindcode:
+        start = time.perf_counter()
+        if image.gl_load():
+            raise Exception()
+        profiler.add('upload', time.perf_counter() - start)
+        profiler.count('gl_loads')
+    texture_budget.touch(image)
+
+    bgl.glActiveTexture(bgl.GL_TEXTURE0)
+    bgl.glBindTexture(bgl.GL_TEXTURE_2D, image.bindcode)
+    profiler.count('binds')
+
+
+def set_adjustments(shader, node):
+    adjust, toggles = get_card_adjustments(node)
+    shader.uniform_float("adjust", adjust)
+    shader.uniform_float("toggles", toggles)
+
+
+def draw_image(node, image, batch):
+    shader = get_shader('image')
+    bind_image(image)
+
     shader.bind()
-    shader.uniform_float("color", color)
+    shader.uniform_int("image", 0)
+    shader.uniform_float("rotation", radians(node.rotation))
+    shader.uniform_float("location", (node.translation_x, node.translation_y))
+    shader.uniform_float("scale", node.scale)
+    shader.uniform_float("u_resolution", lod.get_image_size(node.image))
+    set_adjustments(shader, node)
     batch.draw(shader)
-    bgl.glLineWidth(1)
-    
-    # bgl.glDisable(bgl.GL_BLEND)
-    
-    
-    # Place Header
-    if node.hide:
-        offset = Vector((22, -15)) * dpiFactor
-    else:
-        offset = Vector((23, -15)) * dpiFactor
-    x, y = get_position(node, bpy.context.region, dpiFactor, offset)
-    blf.position(0, int(x), int(y), 0)
-    blf.color(0, 0.9, 0.9, 0.9, 1)
-    
-    
-    blf.size(0, int(12 / node.dimensions.x * w), int(get_dpi()))
-    text = "Select Source" if not node.label else node.label
-    char_width = blf.dimensions(0, "Abcde")[0] / 5
-    text = text[:int((w + (position.x - x)) / char_width)]  
-    blf.draw(0, text)
 
-    
-    if not node.hide and node.image:
-        draw_image(node, ntree, coords)
\ No newline at end of file
+
+def draw_tile(node, image, tile_rect, batch, size):
+    shader = get_shader('tile')
+    bind_image(image)
+
+    shader.bind()
+    shader.uniform_int("image", 0)
+    shader.uniform_float("rotation", radians(node.rotation))
+    shader.uniform_float("location", (node.translation_x, node.translation_y))
+    shader.uniform_float("scale", node.scale)
+    shader.uniform_float("u_resolution", size)
+    shader.uniform_float("tileRect", tile_rect)
+    set_adjustments(shader, node)
+    batch.draw(shader)
+
+
+def draw_profiler_overlay(frame):
+    summary = profiler.get_summary()
+    if summary is None:
+        return
+    lines = ["BlendRef %.2f ms (%d frames)" % (summary['total'], summary['frames'])]
+    lines += ["%s %.2f ms" % (stage, summary[stage]) for stage in profiler.STAGES]
+    lines += ["%s %.1f" % (counter, summary[counter]) for counter in profiler.COUNTERS]
+    dpiFactor = frame.dpi_factor
+    line_height = 14 * dpiFactor
+    blf.size(0, 11, int(frame.dpi))
+    blf.color(0, 1, 1, 1, 1)
+    y = frame.region.height - 30 * dpiFactor
+    for line in lines:
+        blf.position(0, int(10 * dpiFactor), int(y), 0)
+        blf.draw(0, line)
+        y -= line_height
+
+
+def draw_card(node, ntree):
+    BoardRenderer().draw(ntree, [node], DrawContext(bpy.context.region))
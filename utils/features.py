@@ -0,0 +1,210 @@
+import hashlib
+import os
+from .lazy_import import numpy as np
+
+# Levels per channel of the color histogram
+HISTOGRAM_BINS = 4
+DOMINANT_COLORS = 4
+HASH_SIZE = 8
+# Side of the grayscale image the DCT of the perceptual hash runs on
+DCT_SIZE = 32
+# Node tree ID property the features are stored in
+FEATURES_KEY = 'blendref_features'
+
+
+class ImageFeatures:
+    """Compact description of an image for search.
+
+    histogram is the normalised RGB histogram, colors the mean color of the
+    DOMINANT_COLORS fullest histogram bins with their share in weights, and
+    phash a 64 bit DCT perceptual hash as 8 bytes.
+    """
+    __slots__ = ('histogram', 'colors', 'weights', 'phash')
+
+    def __init__(self, histogram, colors, weights, phash):
+        self.histogram = histogram
+        self.colors = colors
+        self.weights = weights
+        self.phash = phash
+
+
+def get_dct_matrix(size):
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    return np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+
+
+def compute_phash(gray):
+    height, width = gray.shape
+    # Nearest samples are plenty on an already downscaled proxy
+    rows = np.linspace(0, height - 1, DCT_SIZE).astype(int)
+    columns = np.linspace(0, width - 1, DCT_SIZE).astype(int)
+    dct_matrix = get_dct_matrix(DCT_SIZE)
+    dct = dct_matrix @ gray[rows][:, columns] @ dct_matrix.T
+    low = dct[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term is the mean brightness, leave it out of the threshold
+    bits = low > np.median(low[1:])
+    return np.packbits(bits).tobytes()
+
+
+def compute_features(pixels):
+    """ImageFeatures of an (h, w, 4) float RGBA array, a proxy is enough"""
+    rgb = pixels[..., :3].reshape(-1, 3)
+    alpha = pixels[..., 3].ravel()
+    levels = np.clip((rgb * HISTOGRAM_BINS).astype(int), 0, HISTOGRAM_BINS - 1)
+    bins = (levels[:, 0] * HISTOGRAM_BINS + levels[:, 1]) * HISTOGRAM_BINS + levels[:, 2]
+    count = HISTOGRAM_BINS ** 3
+    weight = np.bincount(bins, weights=alpha, minlength=count)
+    total = max(weight.sum(), 1e-6)
+    histogram = (weight / total).astype(np.float32)
+
+    fullest = np.argsort(-weight, kind='stable')[:DOMINANT_COLORS]
+    sums = np.stack([np.bincount(bins, weights=rgb[:, channel] * alpha, minlength=count) for channel in range(3)], axis=1)
+    colors = (sums[fullest] / np.maximum(weight[fullest], 1e-6)[:, None]).astype(np.float32)
+    weights = histogram[fullest]
+
+    gray = pixels[..., :3] @ np.array((0.299, 0.587, 0.114), dtype=pixels.dtype)
+    return ImageFeatures(histogram, colors, weights, compute_phash(gray))
+
+
+def popcount64(values):
+    """Set bits of every uint64 in values"""
+    values = values - ((values >> 1) & 0x5555555555555555)
+    values = (values & 0x3333333333333333) + ((values >> 2) & 0x3333333333333333)
+    values = (values + (values >> 4)) & 0x0F0F0F0F0F0F0F0F
+    return (values * 0x0101010101010101) >> 56
+
+
+class FeatureIndex:
+    """Features of every indexed card of a tree stacked into arrays, so a query is a few vector ops.
+
+    Histograms are kept L2 normalised so their similarity is one matrix
+    product, and dominant colors flat with their squared norms so distances
+    to a color are too.
+    """
+
+    def __init__(self, names, features):
+        self.names = names
+        self.rows = {name: i for i, name in enumerate(names)}
+        count = len(features)
+        # Explicit widths, a board without indexed cards gives empty but well shaped arrays
+        histograms = np.array([f.histogram for f in features], dtype=np.float32).reshape(count, HISTOGRAM_BINS ** 3)
+        self.histograms = histograms / np.maximum(np.linalg.norm(histograms, axis=1), 1e-6)[:, None]
+        self.colors = np.array([f.colors for f in features], dtype=np.float32).reshape(count * DOMINANT_COLORS, 3)
+        self.color_norms = (self.colors * self.colors).sum(axis=1)
+        self.weights = np.array([f.weights for f in features], dtype=np.float32).reshape(count * DOMINANT_COLORS)
+        self.hashes = np.frombuffer(b''.join(f.phash for f in features), dtype='>u8').astype(np.uint64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def match_color(self, color, tolerance, min_weight=0.05):
+        """Mask of the cards with a dominant color within tolerance (RGB distance) of color"""
+        color = np.asarray(color, dtype=np.float32)
+        distances = self.color_norms - 2 * (self.colors @ color) + color @ color
+        matches = (distances <= tolerance * tolerance) & (self.weights >= min_weight)
+        return matches.reshape(-1, DOMINANT_COLORS).any(axis=1)
+
+    def hash_distances(self, row):
+        return popcount64(self.hashes ^ self.hashes[row])
+
+    def near_duplicates(self, row, max_distance):
+        distances = self.hash_distances(row)
+        rows = np.flatnonzero(distances <= max_distance)
+        return rows[np.argsort(distances[rows], kind='stable')]
+
+    def most_similar(self, row, count):
+        # Color distribution first, the hash breaks ties between similar palettes
+        distances = 1 - self.histograms @ self.histograms[row]
+        distances += self.hash_distances(row).astype(np.float32) / (HASH_SIZE * 8 * 4)
+        count = min(count + 1, len(distances))
+        rows = np.argpartition(distances, count - 1)[:count]
+        return rows[np.argsort(distances[rows], kind='stable')]
+
+
+def get_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return "%d:%d" % (stat.st_mtime_ns, stat.st_size)
+
+
+def get_record_key(path):
+    # ID property names are limited to 63 characters
+    return hashlib.sha1(path.encode()).hexdigest()[:32]
+
+
+def get_store(ntree, create=False):
+    if FEATURES_KEY not in ntree:
+        if not create:
+            return None
+        ntree[FEATURES_KEY] = {}
+    return ntree[FEATURES_KEY]
+
+
+def store_features(ntree, path, stamp, features):
+    get_store(ntree, create=True)[get_record_key(path)] = {
+        'path': path,
+        'stamp': stamp,
+        'histogram': features.histogram.tolist(),
+        'colors': features.colors.ravel().tolist(),
+        'weights': features.weights.tolist(),
+        'phash': features.phash.hex(),
+    }
+    _indexes.pop(ntree.as_pointer(), None)
+
+
+def load_features(record):
+    return ImageFeatures(
+        np.array(record['histogram'], dtype=np.float32),
+        np.array(record['colors'], dtype=np.float32).reshape(DOMINANT_COLORS, 3),
+        np.array(record['weights'], dtype=np.float32),
+        bytes.fromhex(record['phash']),
+    )
+
+
+def get_record(ntree, path):
+    store = get_store(ntree)
+    if store is None:
+        return None
+    return store.get(get_record_key(path))
+
+
+def needs_features(ntree, path, stamp):
+    record = get_record(ntree, path)
+    return record is None or record['stamp'] != stamp
+
+
+# Node tree pointer -> (node count, FeatureIndex)
+_indexes = {}
+
+
+def free_feature_indexes():
+    _indexes.clear()
+
+
+def get_feature_index(ntree, get_path):
+    """FeatureIndex of the cards of ntree that have features, rows named by node name.
+
+    get_path gives the source path of a card. The index is rebuilt when
+    features are stored or the number of nodes changes.
+    """
+    cached = _indexes.get(ntree.as_pointer())
+    if cached is not None and cached[0] == len(ntree.nodes):
+        return cached[1]
+    names = []
+    features = []
+    store = get_store(ntree)
+    if store is not None:
+        for node in ntree.nodes:
+            if node.bl_idname != 'CardNode':
+                continue
+            path = get_path(node)
+            record = store.get(get_record_key(path)) if path else None
+            if record is not None:
+                names.append(node.name)
+                features.append(load_features(record))
+    index = FeatureIndex(names, features)
+    _indexes[ntree.as_pointer()] = (len(ntree.nodes), index)
+    return index
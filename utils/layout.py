@@ -0,0 +1,144 @@
+from .lazy_import import numpy as np
+
+# Space taken by the card header on top of the image, in node units
+HEADER_HEIGHT = 20
+
+LAYOUT_MODES = [
+    ('SHELF', "Shelf", "Rows of cards at their current size, wrapping at the row width"),
+    ('SKYLINE', "Skyline", "Pack cards at their current size into the lowest free spot, tighter but slower"),
+    ('JUSTIFIED', "Justified Rows", "Resize cards so every row has the same height and fills the row width"),
+]
+
+
+def auto_row_width(widths, heights, spacing):
+    # Aim for a roughly square board
+    area = np.sum((widths + spacing) * (heights + spacing))
+    return max(float(np.max(widths)), float(np.sqrt(area)) * 1.2)
+
+
+def row_starts(widths, row_width, spacing):
+    """Indices where greedy rows of widths (plus spacing) start, one searchsorted per row"""
+    ends = np.cumsum(widths + spacing)
+    starts = [0]
+    count = len(widths)
+    while True:
+        start = starts[-1]
+        offset = ends[start - 1] if start > 0 else 0.0
+        # The row may overshoot by the trailing spacing, and always holds one card
+        stop = max(int(np.searchsorted(ends, offset + row_width + spacing, side='right')), start + 1)
+        if stop >= count:
+            return np.array(starts)
+        starts.append(stop)
+
+
+def place_rows(widths, starts, row_heights, spacing):
+    """Top left corners of cards laid left to right in rows starting at starts"""
+    count = len(widths)
+    row = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, count)))
+    ends = np.cumsum(widths + spacing)
+    x = np.concatenate(([0.0], ends[:-1]))
+    x -= x[starts][row]
+    row_tops = np.concatenate(([0.0], np.cumsum(row_heights + spacing)[:-1]))
+    return x, row_tops[row]
+
+
+def shelf(widths, heights, row_width, spacing):
+    starts = row_starts(widths, row_width, spacing)
+    return place_rows(widths, starts, np.maximum.reduceat(heights, starts), spacing)
+
+
+def justified(widths, heights, row_width, spacing, header):
+    """Rows of equal height scaled to exactly row_width, returns (x, y, new widths)"""
+    # Cards still without an image size are no taller than their header
+    content = np.maximum(heights - header, 1)
+    aspect = widths / content
+    row_height = float(np.median(content))
+    scaled = aspect * row_height
+    starts = row_starts(scaled, row_width, spacing)
+    lengths = np.diff(np.append(starts, len(widths)))
+    row = np.repeat(np.arange(len(starts)), lengths)
+
+    # Every row but the last is stretched to the row width
+    sums = np.add.reduceat(scaled, starts)
+    # Rows without any width are left as they are
+    factor = np.ones(len(starts))
+    np.divide(row_width - spacing * (lengths - 1), sums, out=factor, where=sums > 0)
+    factor[-1] = min(factor[-1], 1.0)
+    new_widths = scaled * factor[row]
+    x, y = place_rows(new_widths, starts, row_height * factor + header, spacing)
+    return x, y, new_widths
+
+
+def skyline(widths, heights, row_width, spacing):
+    """Bottom-left skyline packing, cards are placed tallest first"""
+    count = len(widths)
+    x = np.zeros(count)
+    y = np.zeros(count)
+    # Segments of the skyline as [x, width, depth], wide enough for the widest card and its spacing
+    segments = [[0.0, max(row_width, float(np.max(widths)) + spacing), 0.0]]
+    for i in np.argsort(-heights, kind='stable').tolist():
+        w = float(widths[i]) + spacing
+        h = float(heights[i]) + spacing
+        best = None
+        for start in range(len(segments)):
+            left = segments[start][0]
+            depth = 0.0
+            covered = 0.0
+            end = start
+            while covered < w and end < len(segments):
+                depth = max(depth, segments[end][2])
+                covered = segments[end][0] + segments[end][1] - left
+                end += 1
+            if covered < w:
+                break
+            if best is None or depth < best[0]:
+                best = (depth, left)
+        if best is None:
+            # Rounding in merged segment widths, start a new level on top
+            best = (max(segment[2] for segment in segments), 0.0)
+        depth, left = best
+        x[i] = left
+        y[i] = depth
+
+        # Raise the skyline under the new card
+        right = left + w
+        updated = []
+        for sx, sw, sd in segments:
+            if sx + sw <= left or sx >= right:
+                updated.append([sx, sw, sd])
+                continue
+            if sx < left:
+                updated.append([sx, left - sx, sd])
+            if sx + sw > right:
+                updated.append([right, sx + sw - right, sd])
+        updated.append([left, w, depth + h])
+        updated.sort(key=lambda segment: segment[0])
+        # Merge neighbours at the same depth
+        segments = [updated[0]]
+        for segment in updated[1:]:
+            if segment[2] == segments[-1][2]:
+                segments[-1][1] += segment[1]
+            else:
+                segments.append(segment)
+    return x, y
+
+
+def compute_layout(mode, widths, heights, row_width=0, spacing=20, header=HEADER_HEIGHT):
+    """Lay out cards given NumPy arrays of their widths and heights (header included).
+
+    Returns (x, y, widths) with (x, y) the top left corner of each card,
+    y growing downwards from 0.
+    """
+    widths = np.asarray(widths, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    if len(widths) == 0:
+        return widths, heights, widths
+    if row_width <= 0:
+        row_width = auto_row_width(widths, heights, spacing)
+    if mode == 'JUSTIFIED':
+        return justified(widths, heights, row_width, spacing, header)
+    if mode == 'SKYLINE':
+        x, y = skyline(widths, heights, row_width, spacing)
+    else:
+        x, y = shelf(widths, heights, row_width, spacing)
+    return x, y, widths
@@ -0,0 +1,21 @@
+import importlib
+
+
+class LazyModule:
+    """Stands in for a module and imports it the first time one of its attributes is used.
+
+    Keeps heavy imports such as NumPy out of add-on startup.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+
+numpy = LazyModule('numpy')
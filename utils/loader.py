@@ -0,0 +1,244 @@
+import os
+import queue
+import time
+import bpy
+from . import decode, lod, proxy_cache
+from .atlas import read_pixels
+from .probe import probe_size
+
+TICK_INTERVAL = 0.02
+# Seconds of main thread work per tick
+TICK_BUDGET = 0.015
+MAX_IN_FLIGHT = os.cpu_count() or 1
+
+CARD = 'CARD'
+PROXY = 'PROXY'
+
+
+class LoadRequest:
+    """Something a drawn card is waiting for: its image datablock (CARD) or a proxy level (PROXY)"""
+    __slots__ = ('kind', 'tree', 'generation', 'priority', 'name', 'pointer', 'path', 'level', 'size')
+
+    def __init__(self, kind, tree, generation, priority, name, pointer=0, path='', level=0, size=None):
+        self.kind = kind
+        self.tree = tree
+        self.generation = generation
+        self.priority = priority
+        self.name = name
+        self.pointer = pointer
+        self.path = path
+        self.level = level
+        self.size = size
+
+
+_generations = {}
+_wanted = {}
+_in_flight = {}
+_results = queue.Queue()
+_timer_running = False
+# Cards whose source path could not be loaded, not retried until undo or reload
+_failed = set()
+# Counts the redraws asked for by the add-on itself, each means something new
+# was loaded or changed, so cached board composites are out of date
+redraw_generation = 0
+
+
+def free_loader():
+    global _results, _timer_running
+    if bpy.app.timers.is_registered(tick):
+        bpy.app.timers.unregister(tick)
+    _timer_running = False
+    for future, request in _in_flight.values():
+        future.cancel()
+    _in_flight.clear()
+    _wanted.clear()
+    _generations.clear()
+    _failed.clear()
+    # Late results of cancelled work must not be installed into new data
+    _results = queue.Queue()
+
+
+def tag_node_editors_redraw():
+    global redraw_generation
+    redraw_generation += 1
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'NODE_EDITOR':
+                area.tag_redraw()
+
+
+def begin_frame(ntree):
+    """Start collecting the requests of one redraw of ntree"""
+    pointer = ntree.as_pointer()
+    _generations[pointer] = _generations.get(pointer, 0) + 1
+
+
+def end_frame():
+    global _timer_running
+    if _wanted and not _timer_running:
+        _timer_running = True
+        bpy.app.timers.register(tick, first_interval=TICK_INTERVAL)
+
+
+def add_request(key, request):
+    current = _wanted.get(key)
+    if current is None or current.generation != request.generation or request.priority < current.priority:
+        _wanted[key] = request
+
+
+def request_card(node, priority):
+    """Ask for the image of a card that only has a source path"""
+    ntree = node.id_data
+    tree = ntree.as_pointer()
+    key = (CARD, tree, node.name)
+    if key in _failed:
+        return
+    add_request(key, LoadRequest(CARD, tree, _generations.get(tree, 0), priority, node.name,
+                                 path=node.filepath, size=tuple(node.image_size)))
+
+
+def retry_card(node):
+    """Let a card whose image failed to load try again, e.g. once its file is back"""
+    _failed.discard((CARD, node.id_data.as_pointer(), node.name))
+
+
+def request_proxy(ntree, image, level, priority):
+    tree = ntree.as_pointer()
+    key = (PROXY, image.as_pointer(), level)
+    if key in _wanted and _wanted[key].generation == _generations.get(tree, 0):
+        if priority < _wanted[key].priority:
+            _wanted[key].priority = priority
+        return
+    path = '' if image.packed_file else bpy.path.abspath(image.filepath, library=image.library)
+    add_request(key, LoadRequest(PROXY, tree, _generations.get(tree, 0), priority, image.name,
+                                 image.as_pointer(), path, level, lod.get_image_size(image)))
+
+
+def is_stale(request):
+    # Two editors may show the same tree, so keep requests for one extra redraw
+    return request.generation < _generations.get(request.tree, 0) - 1
+
+
+def find_image(request):
+    image = bpy.data.images.get(request.name)
+    if image is not None and image.as_pointer() == request.pointer:
+        return image
+    return None
+
+
+def find_tree(request):
+    for ntree in bpy.data.node_groups:
+        if ntree.as_pointer() == request.tree:
+            return ntree
+    return None
+
+
+def load_card(key, request):
+    ntree = find_tree(request)
+    node = ntree.nodes.get(request.name) if ntree is not None else None
+    if node is None or node.image or not request.path:
+        return
+    path = bpy.path.abspath(request.path)
+    try:
+        image = bpy.data.images.load(path, check_existing=True)
+    except RuntimeError as e:
+        print('Could not load ' + request.path, e)
+        _failed.add(key)
+        return
+    size = request.size if request.size[0] > 0 else probe_size(path)
+    if size:
+        lod.set_image_size(image, size)
+    # The card already has its final shape (e.g. from a layout or a manifest)
+    width = node.width
+    node.image = image
+    node.width = width
+
+
+def load_proxy_here(request):
+    # Packed images and missing Pillow: Blender decodes on the main thread
+    image = find_image(request)
+    if image is not None and not lod.has_proxy(image, request.level):
+        proxy = lod.get_image_lod(image).proxies[request.level] = lod.make_proxy(image, request.size, request.level)
+        if request.path:
+            proxy_cache.store(request.path, request.level, read_pixels(proxy))
+
+
+def submit_proxy(key, request):
+    results = _results
+
+    def done(future):
+        # Cancelled by tick, which already forgot it
+        if future.cancelled():
+            return
+        error = future.exception()
+        result = decode.DecodeResult(request.path, error=error) if error is not None else future.result()
+        results.put((key, result))
+
+    future = decode.get_executor().submit(decode.decode, request.path, request.level)
+    future.add_done_callback(done)
+    _in_flight[key] = (future, request)
+
+
+def install_result(key, result):
+    entry = _in_flight.pop(key, None)
+    if entry is None:
+        return False
+    request = entry[1]
+    _wanted.pop(key, None)
+    image = find_image(request)
+    if image is None:
+        return False
+    if result.error is not None or result.thumbnail is None:
+        # Maybe a format only Blender reads
+        load_proxy_here(request)
+        return True
+    if result.size is not None:
+        lod.set_image_size(image, result.size)
+    lod.add_proxy(image, result.thumbnail)
+    return True
+
+
+def tick():
+    """Timer callback working through the wanted requests, nearest to the view first"""
+    global _timer_running
+    deadline = time.perf_counter() + TICK_BUDGET
+    redraw = False
+
+    # Cancel what the user panned away from
+    for key in [key for key, request in _wanted.items() if is_stale(request)]:
+        del _wanted[key]
+        entry = _in_flight.get(key)
+        if entry is not None and entry[0].cancel():
+            del _in_flight[key]
+
+    while time.perf_counter() < deadline:
+        try:
+            key, result = _results.get_nowait()
+        except queue.Empty:
+            break
+        redraw |= install_result(key, result)
+
+    pending = sorted((request.priority, key) for key, request in _wanted.items() if key not in _in_flight)
+    for priority, key in pending:
+        if time.perf_counter() >= deadline:
+            break
+        request = _wanted[key]
+        if request.kind == CARD:
+            del _wanted[key]
+            load_card(key, request)
+            redraw = True
+        elif request.path:
+            if len(_in_flight) >= MAX_IN_FLIGHT:
+                continue
+            submit_proxy(key, request)
+        else:
+            del _wanted[key]
+            load_proxy_here(request)
+            redraw = True
+
+    if redraw:
+        tag_node_editors_redraw()
+    if _wanted or _in_flight:
+        return TICK_INTERVAL
+    _timer_running = False
+    return None
@@ -0,0 +1,138 @@
+import bpy
+from .probe import probe_size
+
+LOD_LEVELS = (128, 512, 2048)
+PROXY_PREFIX = ".BlendRef LOD "
+
+
+class ImageLOD:
+    """Downscaled proxies of one source image, indexed by their longest side"""
+    __slots__ = ('size', 'proxies')
+
+    def __init__(self, size):
+        self.size = size
+        self.proxies = {}
+
+
+_image_lods = {}
+
+
+def free_image_lods():
+    _image_lods.clear()
+    for image in [image for image in bpy.data.images if image.name.startswith(PROXY_PREFIX)]:
+        bpy.data.images.remove(image)
+
+
+def free_image_lod(image):
+    """Forget the size and proxies of one image, e.g. after its file changed"""
+    lod = _image_lods.pop(image.as_pointer(), None)
+    if lod is not None:
+        for proxy in lod.proxies.values():
+            bpy.data.images.remove(proxy)
+
+
+def probe_image_size(image):
+    if image.source != 'FILE' or image.packed_file or image.has_data:
+        return None
+    return probe_size(bpy.path.abspath(image.filepath, library=image.library))
+
+
+def get_image_lod(image, size=None):
+    """LOD entry of image, size avoids reading image.size (which decodes) when it is already known"""
+    pointer = image.as_pointer()
+    lod = _image_lods.get(pointer)
+    if lod is None:
+        size = size or probe_image_size(image) or image.size
+        lod = _image_lods[pointer] = ImageLOD(tuple(size))
+    return lod
+
+
+def get_image_size(image, size=None):
+    return get_image_lod(image, size).size
+
+
+def set_image_size(image, size):
+    """Record a size known from elsewhere so reading image.size never forces a decode"""
+    pointer = image.as_pointer()
+    lod = _image_lods.get(pointer)
+    if lod is None:
+        _image_lods[pointer] = ImageLOD(tuple(size))
+    else:
+        lod.size = tuple(size)
+
+
+def add_proxy(image, pixels):
+    """Install already decoded pixels (bottom-up RGBA floats) as a proxy of image"""
+    height, width = pixels.shape[:2]
+    level = min((level for level in LOD_LEVELS if level >= max(width, height)), default=LOD_LEVELS[-1])
+    lod = get_image_lod(image)
+    if level in lod.proxies:
+        return lod.proxies[level]
+    proxy = bpy.data.images.new(PROXY_PREFIX + image.name, width, height, alpha=True)
+    proxy.pixels.foreach_set(pixels.ravel())
+    lod.proxies[level] = proxy
+    return proxy
+
+
+def pick_level(size, required_width):
+    """Smallest level whose proxy is at least required_width texels wide, None for full resolution"""
+    width, height = size
+    longest = max(width, height, 1)
+    for level in LOD_LEVELS:
+        if level >= longest:
+            return None
+        if level * width / longest >= required_width:
+            return level
+    return None
+
+
+def make_proxy(image, size, level):
+    width, height = size
+    factor = level / max(width, height)
+    proxy = image.copy()
+    proxy.name = PROXY_PREFIX + image.name
+    proxy.use_fake_user = False
+    proxy.scale(max(1, round(width * factor)), max(1, round(height * factor)))
+    return proxy
+
+
+def has_proxy(image, level):
+    lod = _image_lods.get(image.as_pointer())
+    return lod is not None and level in lod.proxies
+
+
+def get_proxy(image, level, size=None):
+    """(proxy, missing_level) like get_lod_image, but for a given level whatever the card width.
+
+    While the proxy is missing the sharpest smaller one stands in, or None.
+    """
+    proxies = get_image_lod(image, size).proxies
+    proxy = proxies.get(level)
+    if proxy is not None:
+        return proxy, None
+    smaller = [other for other in proxies if other < level]
+    return (proxies[max(smaller)] if smaller else None), level
+
+
+def get_lod_image(image, required_width, size=None):
+    """Image to draw a card whose visible part spans required_width pixels.
+
+    Returns (image, missing_level). When the wanted proxy does not exist yet
+    the best resident stand-in is returned (None if there is none) together
+    with the level the caller should request from the loader.
+    """
+    lod = get_image_lod(image, size)
+    level = pick_level(lod.size, required_width)
+    if level is None:
+        return image, None
+
+    proxy = lod.proxies.get(level)
+    if proxy is not None:
+        return proxy, None
+
+    # Fall back to whatever is already around, sharper first
+    for other in sorted(lod.proxies, reverse=True):
+        return lod.proxies[other], level
+    if image.bindcode:
+        return image, level
+    return None, level
@@ -0,0 +1,64 @@
+import json
+import os
+
+FORMAT = 'blendref-board'
+VERSION = 1
+# One row per card, in this order
+FIELDS = ('path', 'x', 'y', 'width', 'scale', 'rotation', 'translation_x', 'translation_y', 'label',
+          'image_width', 'image_height')
+
+
+class ManifestCard:
+    """One card of a board manifest, path is absolute"""
+    __slots__ = FIELDS
+
+    def __init__(self, **values):
+        for field in FIELDS:
+            setattr(self, field, values.get(field))
+
+
+def to_manifest_path(path, directory):
+    # Relative paths keep a board and its images movable together
+    try:
+        path = os.path.relpath(path, directory)
+    except ValueError:
+        # Another drive on Windows
+        pass
+    return path.replace(os.sep, '/')
+
+
+def write_manifest(filepath, cards):
+    """Write ManifestCards to filepath, returns the number written"""
+    directory = os.path.dirname(os.path.abspath(filepath))
+    rows = []
+    for card in cards:
+        row = [getattr(card, field) for field in FIELDS]
+        row[0] = to_manifest_path(card.path, directory)
+        rows.append(row)
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump({'format': FORMAT, 'version': VERSION, 'fields': FIELDS, 'cards': rows}, f,
+                  separators=(',', ':'), ensure_ascii=False)
+    return len(rows)
+
+
+def read_manifest(filepath):
+    """ManifestCards of a manifest file, raises ValueError if it is not one"""
+    with open(filepath, encoding='utf-8') as f:
+        try:
+            data = json.load(f)
+        except ValueError:
+            raise ValueError("Not a BlendRef board manifest")
+    if not isinstance(data, dict) or data.get('format') != FORMAT:
+        raise ValueError("Not a BlendRef board manifest")
+    if data.get('version', 0) > VERSION:
+        raise ValueError("Board manifest version %s is newer than this add-on" % data['version'])
+    # Fields are named in the file, so columns added later are skipped by older versions
+    fields = data['fields']
+    directory = os.path.dirname(os.path.abspath(filepath))
+    cards = []
+    for row in data['cards']:
+        card = ManifestCard(**dict(zip(fields, row)))
+        if card.path:
+            card.path = os.path.normpath(os.path.join(directory, card.path))
+        cards.append(card)
+    return cards
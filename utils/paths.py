@@ -0,0 +1,15 @@
+import os
+import sys
+
+
+def get_cache_dir():
+    """Per user cache directory of the add-on, created on first use"""
+    if sys.platform == 'win32':
+        root = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+    elif sys.platform == 'darwin':
+        root = os.path.expanduser('~/Library/Caches')
+    else:
+        root = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    path = os.path.join(root, 'BlendRef')
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,94 @@
+import struct
+
+# SOF markers carry the frame size, DHT (C4), JPG (C8) and DAC (CC) do not
+JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def probe_png(f, head):
+    if head[12:16] == b'IHDR':
+        return struct.unpack('>II', head[16:24])
+    return None
+
+
+def probe_bmp(f, head):
+    header_size, = struct.unpack('<I', head[14:18])
+    if header_size == 12:
+        return struct.unpack('<HH', head[18:22])
+    width, height = struct.unpack('<ii', head[18:26])
+    return abs(width), abs(height)
+
+
+def probe_tiff(f, head):
+    endian = '<' if head[:2] == b'II' else '>'
+    offset, = struct.unpack(endian + 'I', head[4:8])
+    f.seek(offset)
+    count, = struct.unpack(endian + 'H', f.read(2))
+    entries = f.read(count * 12)
+    width = height = None
+    for i in range(0, len(entries) - 11, 12):
+        tag, kind = struct.unpack(endian + 'HH', entries[i:i + 4])
+        if tag not in (256, 257):
+            continue
+        if kind == 3:
+            value, = struct.unpack(endian + 'H', entries[i + 8:i + 10])
+        else:
+            value, = struct.unpack(endian + 'I', entries[i + 8:i + 12])
+        if tag == 256:
+            width = value
+        else:
+            height = value
+    if width is None or height is None:
+        return None
+    return width, height
+
+
+def probe_jpeg(f, head):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = f.read(1)
+        while marker == b'\xff':
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        # Markers without a length segment
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length, = struct.unpack('>H', length_bytes)
+        if marker in JPEG_SOF:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return width, height
+        f.seek(length - 2, 1)
+
+
+def probe_size(path):
+    """(width, height) of a PNG, JPEG, BMP or TIFF file read from its header only, None if unknown"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(32)
+            if head.startswith(b'\x89PNG\r\n\x1a\n'):
+                size = probe_png(f, head)
+            elif head.startswith(b'\xff\xd8'):
+                size = probe_jpeg(f, head)
+            elif head.startswith(b'BM'):
+                size = probe_bmp(f, head)
+            elif head[:4] in (b'II*\x00', b'MM\x00*'):
+                size = probe_tiff(f, head)
+            else:
+                size = None
+    except (OSError, struct.error):
+        return None
+    if size is None or size[0] <= 0 or size[1] <= 0:
+        return None
+    return tuple(size)
@@ -0,0 +1,90 @@
+import csv
+import json
+import time
+from collections import deque
+
+STAGES = ('nodes', 'transform', 'batch', 'upload', 'draw', 'text')
+COUNTERS = ('cards', 'batches', 'binds', 'gl_loads')
+HISTORY = 300
+
+# Recording and the overlay are toggled by blendref.profiler_toggle
+enabled = False
+show_overlay = False
+
+frames = deque(maxlen=HISTORY)
+_current = None
+
+
+class Stage:
+    """Adds the time spent in a with block to a stage of the current frame"""
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        add(self.name, time.perf_counter() - self.start)
+
+
+def begin_frame():
+    global _current
+    if enabled:
+        _current = dict.fromkeys(STAGES + COUNTERS, 0)
+        _current['start'] = time.perf_counter()
+
+
+def end_frame():
+    global _current
+    if _current is None:
+        return
+    start = _current.pop('start')
+    _current['total'] = time.perf_counter() - start
+    # Uploads happen while drawing, report them separately
+    _current['draw'] -= _current['upload']
+    _current['time'] = time.time()
+    frames.append(_current)
+    _current = None
+
+
+def add(stage, seconds):
+    if _current is not None:
+        _current[stage] += seconds
+
+
+def count(counter, amount=1):
+    if _current is not None:
+        _current[counter] += amount
+
+
+def clear():
+    frames.clear()
+
+
+def get_summary():
+    """Mean of every stage (in ms) and counter over the recorded frames"""
+    if not frames:
+        return None
+    summary = {}
+    for key in ('total',) + STAGES:
+        summary[key] = sum(frame[key] for frame in frames) * 1000 / len(frames)
+    for key in COUNTERS:
+        summary[key] = sum(frame[key] for frame in frames) / len(frames)
+    summary['frames'] = len(frames)
+    return summary
+
+
+def export(filepath):
+    fields = ('time', 'total') + STAGES + COUNTERS
+    rows = [{key: frame[key] for key in fields} for frame in frames]
+    if filepath.lower().endswith('.json'):
+        with open(filepath, 'w') as f:
+            json.dump({'stages': STAGES, 'counters': COUNTERS, 'frames': rows}, f, indent=1)
+    else:
+        with open(filepath, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    return len(rows)
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import threading
+from .lazy_import import numpy as np
+from .paths import get_cache_dir
+
+# Updated from the add-on preferences on the main thread, read by workers
+max_bytes = 2048 * 2**20
+
+_lock = threading.Lock()
+_total_bytes = None
+
+
+def get_proxy_dir():
+    path = os.path.join(get_cache_dir(), 'proxies')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_entry_path(path, level):
+    """Cache file of a proxy, keyed by source path, size and mtime so edited files miss"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = "%s|%d|%d|%d" % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, level)
+    return os.path.join(get_proxy_dir(), hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+
+def load(path, level):
+    """Cached proxy of path as a bottom-up RGBA float32 array, None on a miss"""
+    entry = get_entry_path(path, level)
+    if entry is None or not os.path.exists(entry):
+        return None
+    try:
+        pixels = np.load(entry, mmap_mode='r')
+        # Touch the entry so eviction sees it as recently used
+        os.utime(entry)
+    except (OSError, ValueError):
+        return None
+    return pixels.astype(np.float32) / 255
+
+
+def store(path, level, pixels):
+    entry = get_entry_path(path, level)
+    if entry is None:
+        return
+    data = np.clip(pixels * 255 + 0.5, 0, 255).astype(np.uint8)
+    temp = entry + '.%d.tmp' % threading.get_ident()
+    try:
+        with open(temp, 'wb') as f:
+            np.save(f, data)
+        os.replace(temp, entry)
+    except OSError:
+        return
+    added(os.path.getsize(entry))
+
+
+def scan():
+    entries = []
+    for entry in os.scandir(get_proxy_dir()):
+        if entry.name.endswith('.npy'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def added(size):
+    global _total_bytes
+    with _lock:
+        if _total_bytes is None:
+            _total_bytes = sum(size for _, size, _ in scan())
+        else:
+            _total_bytes += size
+        if _total_bytes > max_bytes:
+            evict()
+
+
+def evict():
+    """Delete least recently used entries until the cache is back under 90% of max_bytes"""
+    global _total_bytes
+    entries = sorted(scan())
+    _total_bytes = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if _total_bytes <= max_bytes * 0.9:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        _total_bytes -= size
@@ -0,0 +1,83 @@
+from math import floor
+
+CELL_SIZE = 512
+
+
+class GridIndex:
+    """Uniform grid over card rects in view space.
+
+    Rects are (x, y, width, height) with (x, y) the top left corner, the same
+    layout the draw code uses for cards.
+    """
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.items = {}
+        self.sequence = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get_cells(self, xmin, ymin, xmax, ymax):
+        size = self.cell_size
+        x0, x1 = floor(xmin / size), floor(xmax / size)
+        y0, y1 = floor(ymin / size), floor(ymax / size)
+        return [(i, j) for i in range(x0, x1 + 1) for j in range(y0, y1 + 1)]
+
+    def insert(self, key, value, rect, sequence=None):
+        self.remove(key)
+        if sequence is None:
+            sequence = self.sequence
+            self.sequence += 1
+        x, y, w, h = rect
+        cells = self.get_cells(x, y - h, x + w, y)
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(key)
+        self.items[key] = (value, rect, cells, sequence)
+
+    def remove(self, key):
+        item = self.items.pop(key, None)
+        if item is None:
+            return
+        for cell in item[2]:
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def update(self, key, value, rect):
+        """Move an item to a new rect, keeping its draw order. Returns True if it moved."""
+        item = self.items.get(key)
+        if item is not None and item[1] == rect:
+            return False
+        self.insert(key, value, rect, None if item is None else item[3])
+        return True
+
+    def get_rect(self, key):
+        item = self.items.get(key)
+        return None if item is None else item[1]
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """Return (key, value) pairs whose rect intersects the box, in insertion order"""
+        size = self.cell_size
+        span = (floor(xmax / size) - floor(xmin / size) + 1) * (floor(ymax / size) - floor(ymin / size) + 1)
+        if span > len(self.cells):
+            # Zoomed far out, walking the occupied cells is cheaper than the box
+            cells = (keys for cell, keys in self.cells.items()
+                     if xmin <= (cell[0] + 1) * size and cell[0] * size <= xmax
+                     and ymin <= (cell[1] + 1) * size and cell[1] * size <= ymax)
+        else:
+            cells = (self.cells[cell] for cell in self.get_cells(xmin, ymin, xmax, ymax) if cell in self.cells)
+
+        found = set()
+        for keys in cells:
+            found.update(keys)
+
+        result = []
+        for key in found:
+            value, (x, y, w, h), _, sequence = self.items[key]
+            if x <= xmax and x + w >= xmin and y - h <= ymax and y >= ymin:
+                result.append((sequence, key, value))
+        result.sort(key=lambda item: item[0])
+        return [(key, value) for _, key, value in result]
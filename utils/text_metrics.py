@@ -0,0 +1,74 @@
+from bisect import bisect_right
+from itertools import accumulate
+import blf
+
+FONT_ID = 0
+# Zooming goes through many font sizes, only keep the metrics of the recent ones
+MAX_FONT_SIZES = 32
+
+
+class GlyphMetrics:
+    """Advance widths of the characters measured so far at one font size and DPI.
+
+    The font has to be set to that size with blf.size before measuring.
+    """
+    __slots__ = ('size', 'dpi', 'widths')
+
+    def __init__(self, size, dpi):
+        self.size = size
+        self.dpi = dpi
+        self.widths = {}
+
+    def char_width(self, char):
+        width = self.widths.get(char)
+        if width is None:
+            width = self.widths[char] = blf.dimensions(FONT_ID, char)[0]
+        return width
+
+    def truncate(self, text, max_width):
+        """Longest prefix of text whose measured width fits in max_width"""
+        if max_width <= 0:
+            return ""
+        ends = list(accumulate(self.char_width(char) for char in text))
+        if not ends or ends[-1] <= max_width:
+            return text
+        text = text[:bisect_right(ends, max_width)]
+        # Kerning makes the sum of advances an estimate, check the result once
+        while text and blf.dimensions(FONT_ID, text)[0] > max_width:
+            text = text[:-1]
+        return text
+
+
+_metrics = {}
+# Card pointer -> ((label, size, dpi, width), truncated label)
+_headers = {}
+
+
+def get_metrics(size, dpi):
+    key = (size, dpi)
+    metrics = _metrics.get(key)
+    if metrics is None:
+        if len(_metrics) >= MAX_FONT_SIZES:
+            _metrics.clear()
+        metrics = _metrics[key] = GlyphMetrics(size, dpi)
+    return metrics
+
+
+def get_header_text(node, text, max_width, metrics):
+    """text truncated to max_width, recomputed only when the label, font size or width change"""
+    key = (text, metrics.size, metrics.dpi, int(max_width))
+    pointer = node.as_pointer()
+    cached = _headers.get(pointer)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    truncated = metrics.truncate(text, int(max_width))
+    _headers[pointer] = (key, truncated)
+    return truncated
+
+
+def free_text_metrics(node=None):
+    if node is None:
+        _metrics.clear()
+        _headers.clear()
+    else:
+        _headers.pop(node.as_pointer(), None)
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+import bpy
+
+
+class ResidentTexture:
+    __slots__ = ('name', 'size', 'size_bytes', 'last_frame')
+
+    def __init__(self, name, size, size_bytes, last_frame):
+        self.name = name
+        self.size = size
+        self.size_bytes = size_bytes
+        self.last_frame = last_frame
+
+
+# Least recently drawn first, keyed by image pointer
+_resident = OrderedDict()
+_used_bytes = 0
+_frame = 0
+
+
+def free_texture_budget():
+    global _used_bytes
+    _resident.clear()
+    _used_bytes = 0
+
+
+def get_texture_bytes(image):
+    width, height = image.size
+    channel_bytes = 4 if image.is_float else 1
+    # Blender uploads mipmaps, they add a third on top of the base level
+    return width * height * 4 * channel_bytes * 4 // 3
+
+
+def begin_frame():
+    global _frame
+    _frame += 1
+
+
+def touch(image):
+    """Record that a loaded texture was drawn this frame"""
+    global _used_bytes
+    pointer = image.as_pointer()
+    texture = _resident.get(pointer)
+    if texture is None:
+        texture = _resident[pointer] = ResidentTexture(image.name, tuple(image.size), get_texture_bytes(image), _frame)
+        _used_bytes += texture.size_bytes
+    else:
+        texture.last_frame = _frame
+        _resident.move_to_end(pointer)
+
+
+def forget(image):
+    """Stop tracking the texture of image, e.g. when it is reloaded"""
+    global _used_bytes
+    texture = _resident.pop(image.as_pointer(), None)
+    if texture is not None:
+        _used_bytes -= texture.size_bytes
+
+
+def evict(pointer, texture):
+    global _used_bytes
+    del _resident[pointer]
+    _used_bytes -= texture.size_bytes
+    # Look the image up again instead of holding on to it, it may have been removed
+    image = bpy.data.images.get(texture.name)
+    if image is not None and image.as_pointer() == pointer:
+        image.gl_free()
+
+
+def enforce(budget_bytes, max_idle_frames):
+    """Free least recently drawn textures until under budget and none is idle for too long.
+
+    Textures drawn this frame are never freed, gl_load brings evicted ones back
+    the next time their card is drawn.
+    """
+    while _resident:
+        pointer, texture = next(iter(_resident.items()))
+        if texture.last_frame == _frame:
+            break
+        if _used_bytes <= budget_bytes and _frame - texture.last_frame <= max_idle_frames:
+            break
+        evict(pointer, texture)
+
+
+def get_resident_stats():
+    return len(_resident), _used_bytes
+
+
+def get_resident_textures():
+    """(name, size, bytes) of every resident texture, largest first"""
+    return sorted(((texture.name, texture.size, texture.size_bytes) for texture in _resident.values()),
+                  key=lambda item: item[2], reverse=True)
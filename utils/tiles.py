@@ -0,0 +1,369 @@
+import hashlib
+import math
+import os
+import shutil
+from collections import OrderedDict
+import bpy
+from .lazy_import import numpy as np
+from . import decode, texture_budget
+from .paths import get_cache_dir
+from .lod import LOD_LEVELS
+from .loader import tag_node_editors_redraw
+
+TILE_SIZE = 512
+# Images with a longer side are drawn from tiles whenever a proxy is not enough
+TILED_MIN_SIZE = 8192
+# Tile textures kept around, a card never asks for more than half of them
+MAX_TILES = 96
+# Tiles read from the disk cache and created per redraw
+LOADS_PER_FRAME = 4
+TILE_PREFIX = ".BlendRef Tile "
+BUILD_POLL_INTERVAL = 0.25
+# Updated from the add-on preferences, whole pyramids not in use are deleted above it
+max_bytes = 8192 * 2**20
+
+
+class TilePyramid:
+    """Tiles of one source file at full resolution and every halving still larger than the biggest proxy.
+
+    Level k is the image reduced 2**k times, cut into TILE_SIZE tiles counted
+    from the bottom left. Tiles are built once by a worker into a directory
+    of their own per pyramid, outside the proxy cache so its limit never
+    deletes a pyramid while it is built or drawn.
+    """
+    __slots__ = ('key', 'path', 'size', 'levels', 'future', 'ready', 'failed', 'rebuilt')
+
+    def __init__(self, key, path, size):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.levels = get_level_count(size)
+        self.future = None
+        self.ready = False
+        self.failed = False
+        self.rebuilt = False
+
+
+def get_level_count(size):
+    longest = max(size)
+    levels = 1
+    while math.ceil(longest / 2**levels) > LOD_LEVELS[-1]:
+        levels += 1
+    return levels
+
+
+def get_level_size(size, level):
+    # Pillow's reduce rounds up, so repeated halvings do too
+    return math.ceil(size[0] / 2**level), math.ceil(size[1] / 2**level)
+
+
+def get_pyramid_key(path):
+    stat = os.stat(path)
+    key = "%s|%d|%d|tiles%d" % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, TILE_SIZE)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_tiles_dir():
+    path = os.path.join(get_cache_dir(), 'tiles')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_pyramid_dir(key):
+    return os.path.join(get_tiles_dir(), key)
+
+
+def get_tile_path(key, level, tx, ty):
+    return os.path.join(get_pyramid_dir(key), "%d_%d_%d.npy" % (level, tx, ty))
+
+
+def get_marker_path(key):
+    # Written once every tile is, its mtime is when the pyramid was last used
+    return os.path.join(get_tiles_dir(), key + '.tiles')
+
+
+def get_dir_size(path):
+    size = 0
+    for entry in os.scandir(path):
+        try:
+            size += entry.stat().st_size
+        except OSError:
+            pass
+    return size
+
+
+def evict_pyramids():
+    """Delete least recently used pyramids until the tiles are under 90% of max_bytes, those in use are kept"""
+    pyramids = []
+    for entry in os.scandir(get_tiles_dir()):
+        if not entry.is_dir():
+            continue
+        marker = get_marker_path(entry.name)
+        try:
+            used = os.stat(marker).st_mtime
+        except OSError:
+            # Never finished, e.g. Blender quit during the build
+            used = 0
+        pyramids.append((used, get_dir_size(entry.path), entry.name))
+    total = sum(size for _, size, _ in pyramids)
+    if total <= max_bytes:
+        return
+    # Drawn or still building, deleting them would only start another build
+    in_use = {pyramid.key for pyramid in _pyramids.values()}
+    for used, size, key in sorted(pyramids):
+        if total <= max_bytes * 0.9:
+            break
+        if key in in_use:
+            continue
+        try:
+            # Marker first, a half deleted pyramid is then rebuilt rather than read
+            if os.path.exists(get_marker_path(key)):
+                os.remove(get_marker_path(key))
+        except OSError:
+            continue
+        shutil.rmtree(get_pyramid_dir(key), ignore_errors=True)
+        total -= size
+
+
+def build_pyramid(pyramid):
+    """Cut every level of the pyramid into tile files, runs on a worker"""
+    Image = decode.get_pillow()
+    os.makedirs(get_pyramid_dir(pyramid.key), exist_ok=True)
+    with Image.open(pyramid.path) as image:
+        image = image.convert('RGBA')
+        for level in range(pyramid.levels):
+            if level:
+                image = image.reduce(2)
+            width, height = image.size
+            for ty in range(math.ceil(height / TILE_SIZE)):
+                for tx in range(math.ceil(width / TILE_SIZE)):
+                    # Pillow rows run top down, tiles and textures bottom up
+                    box = (tx * TILE_SIZE, max(height - (ty + 1) * TILE_SIZE, 0),
+                           min((tx + 1) * TILE_SIZE, width), height - ty * TILE_SIZE)
+                    pixels = np.ascontiguousarray(np.asarray(image.crop(box))[::-1])
+                    path = get_tile_path(pyramid.key, level, tx, ty)
+                    with open(path + '.tmp', 'wb') as f:
+                        np.save(f, pixels)
+                    os.replace(path + '.tmp', path)
+    with open(get_marker_path(pyramid.key), 'w') as f:
+        f.write("%d %d %d" % (pyramid.size[0], pyramid.size[1], pyramid.levels))
+
+
+# Source image pointer -> TilePyramid
+_pyramids = {}
+# (pyramid key, level, tx, ty) -> tile image, least recently drawn first
+_tiles = OrderedDict()
+# Keys of the tiles drawn this frame, never evicted before the frame is over
+_drawn = set()
+_loads_left = LOADS_PER_FRAME
+
+
+def free_tiles():
+    _pyramids.clear()
+    _tiles.clear()
+    _drawn.clear()
+    for image in [image for image in bpy.data.images if image.name.startswith(TILE_PREFIX)]:
+        bpy.data.images.remove(image)
+    if bpy.app.timers.is_registered(poll_builds):
+        bpy.app.timers.unregister(poll_builds)
+
+
+def free_image_tiles(image):
+    """Forget the pyramid and tiles of one image, e.g. after its file changed"""
+    pyramid = _pyramids.pop(image.as_pointer(), None)
+    if pyramid is None:
+        return
+    if pyramid.future is not None:
+        pyramid.future.cancel()
+    for key in [key for key in _tiles if key[0] == pyramid.key]:
+        tile = _tiles.pop(key)
+        _drawn.discard(key)
+        texture_budget.forget(tile)
+        bpy.data.images.remove(tile)
+
+
+def begin_frame():
+    global _loads_left
+    _loads_left = LOADS_PER_FRAME
+    _drawn.clear()
+
+
+def use_tiles(image, size):
+    """Whether image should be drawn from tiles instead of one full resolution texture"""
+    return (size is not None and max(size) >= TILED_MIN_SIZE and image.source == 'FILE'
+            and not image.packed_file and decode.get_pillow() is not None)
+
+
+def poll_builds():
+    building = False
+    for pyramid in _pyramids.values():
+        if pyramid.future is None:
+            continue
+        if not pyramid.future.done():
+            building = True
+            continue
+        error = pyramid.future.exception()
+        pyramid.future = None
+        if error is not None:
+            print('Could not tile ' + pyramid.path, error)
+            pyramid.failed = True
+        else:
+            pyramid.ready = True
+    if not building:
+        evict_pyramids()
+        tag_node_editors_redraw()
+        return None
+    return BUILD_POLL_INTERVAL
+
+
+def start_build(pyramid):
+    pyramid.ready = False
+    pyramid.future = decode.get_executor().submit(build_pyramid, pyramid)
+    if not bpy.app.timers.is_registered(poll_builds):
+        bpy.app.timers.register(poll_builds, first_interval=BUILD_POLL_INTERVAL)
+
+
+def get_pyramid(image, size):
+    pointer = image.as_pointer()
+    pyramid = _pyramids.get(pointer)
+    if pyramid is None:
+        path = bpy.path.abspath(image.filepath, library=image.library)
+        try:
+            key = get_pyramid_key(path)
+        except OSError:
+            return None
+        pyramid = _pyramids[pointer] = TilePyramid(key, path, tuple(size))
+        try:
+            # Touch the marker so eviction sees the pyramid as recently used
+            os.utime(get_marker_path(key))
+            pyramid.ready = True
+        except OSError:
+            start_build(pyramid)
+    return pyramid
+
+
+def map_to_image(tc, node, size):
+    """The card node mapping and flips of the image shader applied to (n, 2) texture coordinates"""
+    aspect = size[0] / size[1]
+    tc = (tc - 0.5) / node.scale + (node.translation_x, node.translation_y)
+    theta = math.radians(node.rotation)
+    cos_theta, sin_theta = math.cos(theta), math.sin(theta)
+    x = tc[:, 0] * aspect
+    y = tc[:, 1]
+    uv = np.empty_like(tc)
+    uv[:, 0] = (cos_theta * x + sin_theta * y) / aspect + 0.5
+    uv[:, 1] = -sin_theta * x + cos_theta * y + 0.5
+    if node.flip_x:
+        uv[:, 0] = 1 - uv[:, 0]
+    if node.flip_y:
+        uv[:, 1] = 1 - uv[:, 1]
+    return uv
+
+
+def get_visible_uv(node, rect, frame, size):
+    """(u0, v0, u1, v1) of the part of the image shown in the visible part of the card, None if nothing is"""
+    x, y, w, h = rect
+    xmin, ymin, xmax, ymax = frame.visible_rect
+    left, right = max(x, xmin), min(x + w, xmax)
+    bottom, top = max(y - h, ymin), min(y, ymax)
+    if left >= right or bottom >= top or w <= 0 or h <= 0:
+        return None
+    corners = np.array(((left, bottom), (right, bottom), (right, top), (left, top)))
+    tc = (corners - (x, y - h)) / (w, h)
+    uv = map_to_image(tc, node, size)
+    u0, v0 = np.clip(uv.min(axis=0), 0, 1).tolist()
+    u1, v1 = np.clip(uv.max(axis=0), 0, 1).tolist()
+    if u0 >= u1 or v0 >= v1:
+        return None
+    return u0, v0, u1, v1
+
+
+def get_tile_range(size, level, uv):
+    width, height = get_level_size(size, level)
+    u0, v0, u1, v1 = uv
+    tx0, tx1 = int(u0 * width) // TILE_SIZE, min(int(u1 * width), width - 1) // TILE_SIZE
+    ty0, ty1 = int(v0 * height) // TILE_SIZE, min(int(v1 * height), height - 1) // TILE_SIZE
+    return tx0, ty0, tx1, ty1
+
+
+def load_tile(pyramid, key):
+    global _loads_left
+    _loads_left -= 1
+    path = get_tile_path(*key)
+    try:
+        pixels = np.load(path)
+    except (OSError, ValueError):
+        # Deleted from outside, e.g. the cache was cleared, cut the pyramid
+        # again. Pyramids in use are never evicted, so missing it twice means
+        # the tiles can't be written
+        if pyramid.rebuilt:
+            pyramid.ready = False
+            pyramid.failed = True
+        else:
+            pyramid.rebuilt = True
+            start_build(pyramid)
+        return None
+    height, width = pixels.shape[:2]
+    image = bpy.data.images.new(TILE_PREFIX + os.path.basename(path), width, height, alpha=True)
+    image.pixels.foreach_set((pixels.astype(np.float32) / 255).ravel())
+    return image
+
+
+def evict_tiles():
+    while len(_tiles) > MAX_TILES:
+        key, image = next(iter(_tiles.items()))
+        if key in _drawn:
+            break
+        del _tiles[key]
+        texture_budget.forget(image)
+        bpy.data.images.remove(image)
+
+
+def get_tiles(node, image, size, rect, frame):
+    """[(tile image, (u, v, width, height) of the tile in the image)] covering the visible part of a card.
+
+    Tiles that are not loaded yet are left out, the caller draws a proxy below.
+    """
+    pyramid = get_pyramid(image, size)
+    if pyramid is None or not pyramid.ready:
+        return []
+    uv = get_visible_uv(node, rect, frame, size)
+    if uv is None:
+        return []
+
+    # Image pixels per screen pixel picks the level
+    ratio = size[0] / max(rect[2] * frame.scale_x * node.scale, 1)
+    level = min(max(int(math.floor(math.log2(ratio))), 0) if ratio > 1 else 0, pyramid.levels - 1)
+    while True:
+        tx0, ty0, tx1, ty1 = get_tile_range(size, level, uv)
+        if (tx1 - tx0 + 1) * (ty1 - ty0 + 1) <= MAX_TILES // 2 or level == pyramid.levels - 1:
+            break
+        level += 1
+
+    width, height = get_level_size(size, level)
+    tiles = []
+    missing = False
+    for ty in range(ty0, ty1 + 1):
+        for tx in range(tx0, tx1 + 1):
+            key = (pyramid.key, level, tx, ty)
+            tile = _tiles.get(key)
+            if tile is not None:
+                _tiles.move_to_end(key)
+            elif _loads_left > 0:
+                tile = load_tile(pyramid, key)
+                if tile is None:
+                    return []
+                _tiles[key] = tile
+            else:
+                missing = True
+                continue
+            _drawn.add(key)
+            tile_width = min(TILE_SIZE, width - tx * TILE_SIZE)
+            tile_height = min(TILE_SIZE, height - ty * TILE_SIZE)
+            tiles.append((tile, (tx * TILE_SIZE / width, ty * TILE_SIZE / height,
+                                 tile_width / width, tile_height / height)))
+    evict_tiles()
+    if missing and not bpy.app.timers.is_registered(tag_node_editors_redraw):
+        # Load the rest on the next redraws
+        bpy.app.timers.register(tag_node_editors_redraw, first_interval=0.01)
+    return tiles
@@ -0,0 +1,102 @@
+import os
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff'}
+# Known files stat'ed per diff while the folder listing itself is unchanged
+STAT_BUDGET = 256
+
+
+def get_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def scan_folder(directory):
+    """(mtime, size) of every image directly in directory, by path"""
+    entries = {}
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        pass
+    return entries
+
+
+class FolderIndex:
+    """Images of a folder as of the last diff, keyed by path with their (mtime, size).
+
+    The folder is only listed again when its own mtime changes, which happens
+    when files are added, removed or renamed. Otherwise a diff re-stats
+    STAT_BUDGET known files in turn to notice edited ones, so a tick stays
+    cheap with thousands of images. New files are reported once their
+    (mtime, size) is the same on two diffs in a row, so files still being
+    copied in are not imported half written.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.folder_mtime = None
+        self.entries = {}
+        self.pending = {}
+        self.order = []
+        self.cursor = 0
+
+    def diff(self):
+        """(added, changed, removed) paths since the last diff, the first ones report every image as added"""
+        added, changed, removed = [], [], []
+
+        # Files seen on an earlier diff that did not change since are complete
+        for path, stat in list(self.pending.items()):
+            current = get_stat(path)
+            if current == stat:
+                del self.pending[path]
+                self.entries[path] = stat
+                self.order.append(path)
+                added.append(path)
+            elif current is None:
+                del self.pending[path]
+            else:
+                self.pending[path] = current
+
+        folder = get_stat(self.directory)
+        folder_mtime = folder[0] if folder else None
+        if folder_mtime != self.folder_mtime:
+            self.folder_mtime = folder_mtime
+            current = scan_folder(self.directory)
+            for path, stat in current.items():
+                old = self.entries.get(path)
+                if old is None:
+                    self.pending.setdefault(path, stat)
+                elif old != stat:
+                    changed.append(path)
+            removed = [path for path in self.entries if path not in current]
+            for path in list(self.pending):
+                if path not in current:
+                    del self.pending[path]
+            self.entries = {path: stat for path, stat in current.items() if path in self.entries}
+            self.order = list(self.entries)
+            self.cursor = 0
+        elif self.order:
+            start = self.cursor % len(self.order)
+            paths = self.order[start:start + STAT_BUDGET]
+            self.cursor = start + len(paths)
+            for path in paths:
+                current = get_stat(path)
+                if current is None:
+                    # Deleting a file changes the folder mtime, the next diff lists it
+                    continue
+                if current != self.entries[path]:
+                    self.entries[path] = current
+                    changed.append(path)
+        return added, changed, removed